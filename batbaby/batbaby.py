@@ -1,39 +1,324 @@
-from collections import namedtuple
-from time import sleep
+import csv
+import json
+import os.path
+import re
+import sqlite3
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep, time
+from xml.etree import ElementTree
 
 import click
 import requests
 from bs4 import BeautifulSoup
 
-@click.command()
-@click.option('--key', '-k',
-              type=click.STRING,
-              help='Goodreads dev API key',
-             )
-def main(key):
+Book = namedtuple('Book', ['title', 'author', 'rating'])
+
+GOODREADS_URL = 'https://www.goodreads.com'
+# Goodreads' review counts endpoint takes up to 1000 ISBNs, but keep URLs a sensible length.
+ISBN_BATCH_SIZE = 100
+ISBN_PATTERN = re.compile(r'\b(\d{13}|\d{9}[\dX])\b')
+
+DEFAULT_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                             'batbaby', 'ratings.sqlite3')
+
+
+class TokenBucket:
+    """Thread-safe token bucket. Each acquire() takes one token, blocking until one is available.
+    Tokens are added at `rate` per second up to `capacity`, so requests go out on the tick
+    without waiting for earlier responses to come back.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # Take the token now (may go negative) and wait until it would have been available.
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            sleep(wait)
+
+
+class RatingCache:
+    """Local cache of Goodreads ratings keyed by normalised title and author.
+    Books that weren't found are cached too (rating NULL), with their own TTL.
+    """
+    def __init__(self, path, ttl, negative_ttl):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS ratings ('
+                        'title TEXT, author TEXT, rating TEXT, fetched REAL, PRIMARY KEY (title, author))')
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    @staticmethod
+    def normalise(text):
+        return ' '.join(str(text or '').lower().split())
+
+    def get(self, title, author):
+        """Returns (hit, rating). hit is False if book isn't cached or the cached rating is stale."""
+        row = self.db.execute('SELECT rating, fetched FROM ratings WHERE title = ? AND author = ?',
+                              (self.normalise(title), self.normalise(author))).fetchone()
+        if row is None:
+            return False, None
+        rating, fetched = row
+        ttl = self.ttl if rating is not None else self.negative_ttl
+        if time() - fetched > ttl:
+            return False, None
+        return True, rating
+
+    def put(self, title, author, rating):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO ratings (title, author, rating, fetched) VALUES (?, ?, ?, ?)',
+                            (self.normalise(title), self.normalise(author), rating, time()))
+
+    def close(self):
+        self.db.close()
+
+
+def get_books():
+    """Get (title, author, ISBN or None) of each book in the Wikipedia table."""
     url = "https://en.wikipedia.org/wiki/List_of_Batman_children's_books"
     r = requests.get(url)
     soup = BeautifulSoup(r.content, 'lxml')
     table = soup.find("table", attrs={'class': 'wikitable'})
     table_rows = table.find_all('tr', attrs={'style':'text-align: center; background:#F2F2F2;'})
 
-    Book = namedtuple('Book', ['title', 'author', 'rating'])
     books = []
+    for row in table_rows:
+        title = row.find('td', attrs={'style': 'text-align: left;'}).string
+        author = title.findNext('td').string
+        isbn = ISBN_PATTERN.search(row.get_text().replace('-', ''))
+        books.append((title, author, isbn.group(1) if isbn else None))
+    return books
+
+
+def lookup_ratings_by_isbn(session, bucket, key, isbns, api_url=GOODREADS_URL):
+    """Get Goodreads average ratings for many books at once using the batch review counts endpoint.
+    Returns dict of ISBN -> rating for the books that were found.
+    """
+    found = {}
+    for start in range(0, len(isbns), ISBN_BATCH_SIZE):
+        batch = isbns[start:start + ISBN_BATCH_SIZE]
+        bucket.acquire()
+        r = session.get(f'{api_url}/book/review_counts.json', params={'key': key, 'isbns': ','.join(batch)})
+        if r.status_code == 404:
+            # Goodreads returns 404 if none of the ISBNs were found.
+            continue
+        r.raise_for_status()
+        for book in r.json()['books']:
+            for isbn in (book.get('isbn'), book.get('isbn13')):
+                if isbn:
+                    found[isbn] = book['average_rating']
+    return found
+
+
+def parse_average_rating(stream):
+    """Get first average_rating from Goodreads XML response, without reading the rest of the response."""
+    for _, element in ElementTree.iterparse(stream):
+        if element.tag == 'average_rating':
+            return element.text
+    return None
+
+
+def lookup_rating(session, bucket, key, title, author, api_url=GOODREADS_URL):
+    """Get Goodreads average rating for book (None if not found), waiting for the rate limiter first.
+    Raises on HTTP errors (bad key, throttling...) or a broken response rather than returning None,
+    so that they don't get cached as 'not found'.
+    """
+    bucket.acquire()
+    r = session.get(f'{api_url}/search/index.xml', params={'key': key, 'q': f'{title} {author}'}, stream=True)
+    try:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        return parse_average_rating(r.raw)
+    finally:
+        r.close()
 
-    with click.progressbar(table_rows) as rows:
-        for row in rows:
-            title = row.find('td', attrs={'style': 'text-align: left;'}).string
-            author = title.findNext('td').string
 
-            gurl = f"https://www.goodreads.com/search/index.xml?key={key}&q={title} {author}"
-            r = requests.get(gurl)
-            soup = BeautifulSoup(r.content, 'lxml')
-            rating = soup.find('average_rating').string
+def iter_books(rows, ratings, lookup, executor, window):
+    """Generator that returns Book for each row in table order as soon as its lookup is done.
+    Cached ratings are used where possible, and at most `window` lookups are queued at a time
+    so memory use doesn't grow with the number of rows.
+    A failed lookup raises here, before anything is cached or written for that row, so a rerun
+    carries on from it.
+    """
+    pending = deque()
+    rows = iter(rows)
+    while True:
+        # Keep the queue topped up.
+        while len(pending) < window:
+            row = next(rows, None)
+            if row is None:
+                break
+            title, author = row[:2]
+            hit, rating = ratings.get(title, author)
+            pending.append((title, author, hit, rating if hit else executor.submit(lookup, *row)))
+        if not pending:
+            return
+        title, author, hit, result = pending.popleft()
+        if hit:
+            rating = result
+        else:
+            rating = result.result()
+            ratings.put(title, author, rating)
+        yield Book(title=title, author=author, rating=rating)
+
+
+class BookWriter:
+    """Writes books to a CSV or JSON Lines file one at a time, recording progress in a checkpoint file
+    so that an interrupted run can carry on after the last row written.
+    Output to stdout ('-') isn't resumable so has no checkpoint.
+    """
+    def __init__(self, path, output_format):
+        self.to_stdout = path == '-'
+        self.checkpoint = None if self.to_stdout else path + '.checkpoint'
+        self.rows_done = 0
+        # (title, author) of the last row written
+        self.last_written = None
+
+        offset = None
+        if self.checkpoint and os.path.isfile(self.checkpoint) and os.path.isfile(path):
+            with open(self.checkpoint) as f:
+                checkpoint = json.load(f)
+            self.rows_done, offset = checkpoint['rows'], checkpoint['offset']
+            self.last_written = tuple(checkpoint['last']) if checkpoint.get('last') else None
+            # Drop anything written after the last checkpoint (eg. row written just before a crash).
+            os.truncate(path, offset)
+
+        if self.to_stdout:
+            self.file = click.get_text_stream('stdout')
+        else:
+            self.file = open(path, 'a' if offset is not None else 'w', newline='')
+        self.csv = csv.writer(self.file) if output_format == 'csv' else None
+        if self.csv and offset is None:
+            self.csv.writerow(Book._fields)
+            self.save_checkpoint()
+
+    def remaining(self, rows):
+        """Get the rows that still need writing.
+        The book list is downloaded again on each run and may have changed since the checkpoint, so rows
+        are resumed after the last (title, author) written rather than by position.
+        """
+        if self.last_written is None:
+            if self.rows_done:
+                # Checkpoint from an older version, which only recorded the number of rows.
+                raise click.ClickException(f'Checkpoint has no last row, unable to resume. '
+                                           f'Delete {self.checkpoint} to start again.')
+            return rows
+        matches = [i for i, row in enumerate(rows) if tuple(row[:2]) == self.last_written]
+        if not matches:
+            title, author = self.last_written
+            raise click.ClickException(f'Last row written ({title} by {author}) is no longer in the book list, '
+                                       f'unable to resume. Delete {self.checkpoint} to start again.')
+        # If the book is listed more than once, take the one nearest to where the last run got to.
+        last = min(matches, key=lambda i: abs(i - (self.rows_done - 1)))
+        return rows[last + 1:]
+
+    def write(self, book):
+        if self.csv:
+            self.csv.writerow(book)
+        else:
+            self.file.write(json.dumps(book._asdict(), ensure_ascii=False) + '\n')
+        self.rows_done += 1
+        self.last_written = (book.title, book.author)
+        self.save_checkpoint()
+
+    def save_checkpoint(self):
+        self.file.flush()
+        if self.checkpoint:
+            with open(self.checkpoint + '.tmp', 'w') as f:
+                json.dump({'rows': self.rows_done, 'offset': self.file.tell(), 'last': self.last_written}, f)
+            os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+    def close(self, finished=False):
+        if not self.to_stdout:
+            self.file.close()
+        if finished and self.checkpoint and os.path.isfile(self.checkpoint):
+            os.remove(self.checkpoint)
+
+
+@click.command()
+@click.option('--key', '-k',
+              type=click.STRING,
+              help='Goodreads dev API key',
+             )
+@click.option('--rate', '-r',
+              default=1.0,
+              help='Max Goodreads requests per second (API limit is 1)',
+             )
+@click.option('--workers', '-w',
+              default=8,
+              help='Max number of requests in flight at once',
+             )
+@click.option('--cache', '-c',
+              type=click.Path(),
+              default=DEFAULT_CACHE,
+              help='Path to rating cache. Defaults to XDG cache dir.',
+             )
+@click.option('--ttl',
+              default=30,
+              help='Days before a cached rating is looked up again',
+             )
+@click.option('--negative-ttl',
+              default=7,
+              help='Days before a book that was not found is looked up again',
+             )
+@click.option('--output', '-o',
+              default='-',
+              help='File to write results to as they come in. Interrupted runs resume from the last row written.',
+             )
+@click.option('--format', '-f', 'output_format',
+              type=click.Choice(['jsonl', 'csv']),
+              default='jsonl',
+              help='Output format',
+             )
+@click.option('--api-url',
+              default=GOODREADS_URL,
+              help='Goodreads API base URL',
+             )
+def main(key, rate, workers, cache, ttl, negative_ttl, output, output_format, api_url):
+    rows = get_books()
+    bucket = TokenBucket(rate)
+    session = requests.Session()
+    ratings = RatingCache(cache, ttl * 86400, negative_ttl * 86400)
+    writer = BookWriter(output, output_format)
+    try:
+        rows = writer.remaining(rows)
+    except click.ClickException:
+        writer.close()
+        ratings.close()
+        raise
+
+    # Look up all uncached books with an ISBN in a few batch requests, then only search for the rest.
+    isbns = [isbn for title, author, isbn in rows if isbn and not ratings.get(title, author)[0]]
+    isbn_ratings = lookup_ratings_by_isbn(session, bucket, key, isbns, api_url)
 
-            books.append(Book(title=title, author=author, rating=rating))
-            sleep(1)  # to abide by Goodreads' API limits
+    def lookup(title, author, isbn):
+        if isbn in isbn_ratings:
+            return isbn_ratings[isbn]
+        return lookup_rating(session, bucket, key, title, author, api_url)
 
-    print(books)
+    finished = False
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            books = iter_books(rows, ratings, lookup, executor, window=workers * 2)
+            with click.progressbar(books, length=len(rows), file=click.get_text_stream('stderr')) as bar:
+                for book in bar:
+                    writer.write(book)
+        finished = True
+    finally:
+        writer.close(finished)
+        ratings.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Local stand-ins for the I/O boundaries the scripts talk to, for use by the benchmarks.
+
+StubHTTPServer  - HTTP server on localhost serving canned responses (Gmail, Goodreads, forum pages...)
+UdpListener     - counts datagrams sent to a loopback UDP port (WOL magic packets)
+TcpListener     - accepts TCP connections on a loopback port (WOL wake probes)
+SmtpListener    - minimal SMTP server on localhost that keeps the messages it receives (farcasoup notices)
+PtyDevice       - pseudo terminal with a fake device (MCU, TV) answering on the other end
+"""
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import StreamRequestHandler, ThreadingMixIn, ThreadingTCPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(ThreadingTCPServer):
+    daemon_threads = True
+
+
+class StubHTTPServer:
+    """Serve canned responses. routes is a list of (path prefix, handler) and the first route whose prefix
+    matches the request path is used. handler takes the path and parsed query string and returns
+    (status, content type, body bytes).
+    """
+    def __init__(self, routes):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are sent separately, don't let Nagle + delayed ACK add 40 ms to every response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                for prefix, handler in routes:
+                    if url.path.startswith(prefix):
+                        status, content_type, body = handler(url.path, parse_qs(url.query))
+                        break
+                else:
+                    status, content_type, body = 404, 'text/plain', b'not found'
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class UdpListener:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.received = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.sock.recv(2048)
+            except OSError:
+                return
+            self.received += 1
+
+    def close(self):
+        self.sock.close()
+
+
+class TcpListener:
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class SmtpListener:
+    """SMTP server on localhost with no TLS or auth (the client has to be told not to use them).
+    Every message received is appended to messages as (sender, recipients, message bytes).
+    """
+    def __init__(self):
+        messages = self.messages = []
+
+        class Handler(StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line + b'\r\n')
+
+            def handle(self):
+                self.reply(b'220 localhost stub SMTP')
+                sender, recipients = None, []
+                for line in self.rfile:
+                    line = line.rstrip(b'\r\n')
+                    command = line[:4].upper()
+                    if command in (b'EHLO', b'HELO'):
+                        self.reply(b'250 localhost')
+                    elif command == b'MAIL':
+                        sender, recipients = line.split(b':', 1)[1].strip(), []
+                        self.reply(b'250 OK')
+                    elif command == b'RCPT':
+                        recipients.append(line.split(b':', 1)[1].strip())
+                        self.reply(b'250 OK')
+                    elif command == b'DATA':
+                        self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+                        data = []
+                        for data_line in self.rfile:
+                            if data_line.rstrip(b'\r\n') == b'.':
+                                break
+                            # undo dot stuffing
+                            data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                        messages.append((sender, recipients, b''.join(data)))
+                        self.reply(b'250 OK')
+                    elif command in (b'RSET', b'NOOP'):
+                        self.reply(b'250 OK')
+                    elif command == b'QUIT':
+                        self.reply(b'221 Bye')
+                        return
+                    else:
+                        self.reply(b'502 Command not implemented')
+
+        self.server = _ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class PtyDevice:
+    """Fake serial device. respond is called with each chunk of bytes written to the port
+    and returns the bytes to send back (or b'' for no reply).
+    Open slave_name with pyserial as if it were a real port.
+    """
+    def __init__(self, respond):
+        import pty  # Unix only
+        import tty
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.slave_name = os.ttyname(self.slave)
+        self.respond = respond
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            if not data:
+                return
+            reply = self.respond(data)
+            if reply:
+                os.write(self.master, reply)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the hot paths of every script in the repo, plus end-to-end runs against local fakes
+(pty serial devices, a stub HTTP server, loopback UDP/TCP listeners, an SMTP stand-in - see fakes.py) so that nothing
+real (MCU, TV, Gmail, Goodreads, the LAN) is needed.
+
+    python benchmarks/run_benchmarks.py [--filter TEXT] [--output FILE] [--baseline FILE] [--save-baseline]
+
+Results are written as JSON (seconds per operation, lower is better) and compared against the
+stored baseline (benchmarks/baseline.json). Exits with status 1 if any benchmark fails or is more
+than --tolerance slower. Run with --save-baseline on the machine you care about to store a new baseline.
+
+Benchmarks whose script can't be imported (eg. pyserial or requests not installed, no pty support)
+are recorded as skipped. Any other exception (eg. a parser that crashes or returns the wrong result)
+is recorded as an error. farcasoup is python 2 only so its parsers are timed in a subprocess running
+the interpreter named by the PYTHON2 environment variable (default python2). The same goes for its
+notice email, which is sent to the local SMTP stand-in with TLS turned off (farcasoup.smtp_tls).
+"""
+import argparse
+import asyncio
+import datetime as dt
+import email
+import importlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from queue import Queue
+
+from fakes import PtyDevice, SmtpListener, StubHTTPServer, TcpListener, UdpListener
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_PATH = os.path.join(REPO_PATH, 'benchmarks')
+DEFAULT_OUTPUT = os.path.join(BENCHMARKS_PATH, 'results.json')
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_PATH, 'baseline.json')
+PYTHON2 = os.environ.get('PYTHON2', 'python2')
+
+BENCHMARKS = []
+
+
+class Skip(Exception):
+    pass
+
+
+def benchmark(name):
+    """
+    register benchmark function. the function returns seconds per operation, or raises Skip
+    """
+    def register(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return register
+
+
+def load_module(project, name):
+    """
+    import module from one of the project directories, with the directory on sys.path while it's imported
+    so that its own local imports work. only one project is on sys.path at a time, some of them use
+    different modules with the same name (eg. hangoutsclient)
+    """
+    project_path = os.path.join(REPO_PATH, project)
+    module_name = '%s_%s' % (project, name)
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    sys.path.insert(0, project_path)
+    try:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(project_path, name + '.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except ImportError as e:
+        raise Skip('%s/%s.py: %s' % (project, name, e))
+    finally:
+        sys.path.remove(project_path)
+    sys.modules[module_name] = module
+    return module
+
+
+def time_per_op(func, number=None, repeat=5):
+    """
+    best of `repeat` runs of `number` calls (picked automatically to take at least 0.2 s)
+    """
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+class FakePort(object):
+    """
+    in-memory stand in for serial.Serial, replays the same input for every operation
+    """
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def rewind(self):
+        self.stream.seek(0)
+
+    def read(self, size=1):
+        return self.stream.read(size)
+
+    def readline(self):
+        return self.stream.readline()
+
+    def inWaiting(self):  # pylint: disable=invalid-name
+        return len(self.stream.getbuffer()) - self.stream.tell()
+
+    def write(self, data):
+        return len(data)
+
+
+# Canned device and API responses
+
+MCU_RESPONSE = b'\x01\x00\x17\x2a\x03\xe8\x00\x41\xff'
+AQUOS_RESPONSE = b'OK\r'
+MACS = ['00:1a:2b:%02x:%02x:%02x' % (i // 65536, i // 256 % 256, i % 256) for i in range(200)]
+
+
+def goodreads_search_xml(works=20):
+    """
+    search/index.xml response with `works` results, like the real one the interesting bit is near the top
+    """
+    results = ''.join(
+        '<work><id type="integer">%d</id><books_count type="integer">3</books_count>'
+        '<ratings_count type="integer">%d</ratings_count><average_rating>%.2f</average_rating>'
+        '<best_book type="Book"><id type="integer">%d</id><title>Batman Book %d</title>'
+        '<author><id type="integer">7</id><name>Some Author</name></author></best_book></work>'
+        % (i, 100 + i, 3 + i / 100.0, 1000 + i, i) for i in range(works))
+    return ('<?xml version="1.0" encoding="UTF-8"?><GoodreadsResponse><Request><authentication>true'
+            '</authentication><key>k</key><method>search_index</method></Request><search>'
+            '<query>batman</query><results-start>1</results-start><results-end>%d</results-end>'
+            '<total-results>%d</total-results><source>Goodreads</source><results>%s</results>'
+            '</search></GoodreadsResponse>' % (works, works, results)).encode()
+
+
+# Microbenchmarks
+
+@benchmark('micro.hangouts_serial.get_response_until')
+def bench_serial_framing():
+    serialmanager = load_module('hangouts_serial', 'serialmanager')
+    manager = serialmanager.SerialManager.__new__(serialmanager.SerialManager)
+    manager.eolchar = b'\xFF'
+    manager.ser = FakePort(MCU_RESPONSE)
+
+    def read_frame():
+        manager.ser.rewind()
+        manager.get_response_until()
+    return time_per_op(read_frame)
+
+
+@benchmark('micro.aquos.build_command')
+def bench_aquos_build_command():
+    aquos_cmd = load_module('aquos_serial_control', 'aquos_cmd')
+    return time_per_op(lambda: aquos_cmd.AquosControl.build_command(aquos_cmd.CMD_VOLM, b'30'))
+
+
+@benchmark('micro.aquos.parse_response')
+def bench_aquos_parse_response():
+    aquos_cmd = load_module('aquos_serial_control', 'aquos_cmd')
+    controller = aquos_cmd.AquosControl.__new__(aquos_cmd.AquosControl)
+    controller.ser = FakePort(AQUOS_RESPONSE)
+
+    def send():
+        controller.ser.rewind()
+        controller.send_rs232_command(aquos_cmd.CMD_POWR_STATUS)
+    # only time the reading/decoding, not the fixed wait for the TV to answer
+    sleep = aquos_cmd.sleep
+    aquos_cmd.sleep = lambda seconds: None
+    try:
+        return time_per_op(send)
+    finally:
+        aquos_cmd.sleep = sleep
+
+
+@benchmark('micro.shamer.extract_event_dates')
+def bench_shamer_parse():
+    bench_parse = load_module('futsal_shamer', 'bench_parse')
+    messages = bench_parse.load_corpus()
+    failures = bench_parse.check_corpus(messages)
+    if failures:
+        raise RuntimeError('shamer parse results differ from expected: %s' % failures)
+
+    def parse_corpus():
+        for message in messages:
+            for _ in bench_parse.extract_event_dates(message):
+                pass
+    return time_per_op(parse_corpus) / len(messages)
+
+
+FARCASOUP_SNIPPET = '''
+import json, os, sys, timeit
+sys.path.insert(0, sys.argv[1])
+try:
+    import bench_parse
+except ImportError as e:
+    print(json.dumps({'skipped': 'bench_parse.py: %s' % e}))
+    sys.exit()
+with open(os.path.join(bench_parse.fixtures_path, sys.argv[2]), 'rb') as f:
+    html = f.read()
+func = getattr(bench_parse, sys.argv[3])
+number = int(sys.argv[4])
+print(json.dumps({'seconds_per_op': min(timeit.Timer(lambda: func(html)).repeat(5, number)) / number}))
+'''
+
+
+def run_farcasoup(snippet, *args):
+    """
+    run snippet with python 2 in the farcasoup directory, returns the dict it prints as JSON on its last line
+    """
+    command = [PYTHON2, '-c', snippet, os.path.join(REPO_PATH, 'farcasoup')] + [str(arg) for arg in args]
+    try:
+        # keep anything farcasoup writes to the current directory out of the repo
+        with tempfile.TemporaryDirectory() as work_dir:
+            output = subprocess.check_output(command, stderr=subprocess.PIPE, cwd=work_dir)
+    except OSError as e:
+        raise Skip('farcasoup needs python 2 (%s: %s)' % (PYTHON2, e.strerror))
+    except subprocess.CalledProcessError as e:
+        if e.returncode == 127:
+            # shell/pyenv shim: command not found
+            raise Skip('farcasoup needs python 2 (%s not found)' % PYTHON2)
+        lines = e.stderr.decode(errors='replace').strip().splitlines()
+        raise RuntimeError('farcasoup: %s' % (lines[-1] if lines else 'exit status %d' % e.returncode))
+    # farcasoup prints progress messages, result is on the last line
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    if 'skipped' in result:
+        raise Skip('farcasoup: %s' % result['skipped'])
+    return result
+
+
+def farcasoup_parse(fixture, func_name, number=20):
+    return run_farcasoup(FARCASOUP_SNIPPET, fixture, func_name, number)['seconds_per_op']
+
+
+@benchmark('micro.farcasoup.parse_forum_threads')
+def bench_farcasoup_forum():
+    return farcasoup_parse('forum_page.html', 'strainer_forum')
+
+
+@benchmark('micro.farcasoup.parse_thread_links')
+def bench_farcasoup_thread():
+    return farcasoup_parse('thread_page.html', 'strainer_thread')
+
+
+@benchmark('micro.batbaby.parse_average_rating')
+def bench_batbaby_xml():
+    batbaby = load_module('batbaby', 'batbaby')
+    xml = goodreads_search_xml()
+    assert batbaby.parse_average_rating(io.BytesIO(xml)) == '3.00'
+    return time_per_op(lambda: batbaby.parse_average_rating(io.BytesIO(xml)))
+
+
+@benchmark('micro.send_wol.build_magic_packet')
+def bench_build_magic_packet():
+    send_wol = load_module('send_wol', 'send_wol')
+    return time_per_op(lambda: send_wol.build_magic_packet('00:1A:2B:3C:4D:5E'))
+
+
+# End-to-end against local fakes
+
+@benchmark('e2e.hangouts_serial.round_trip')
+def bench_serial_round_trip():
+    serialmanager = load_module('hangouts_serial', 'serialmanager')
+    try:
+        device = PtyDevice(lambda command: MCU_RESPONSE)
+    except (ImportError, OSError) as e:
+        raise Skip('no pty support: %s' % e)
+    command_queue, response_queue = Queue(), Queue()
+    # SerialManager waits 2 s for the MCU to start up, outside of the timing
+    manager = serialmanager.SerialManager(device.slave_name, command_queue, response_queue, eolchar=b'\xFF')
+    manager.start()
+
+    def round_trip():
+        command_queue.put(b'\x01\x10')
+        assert response_queue.get(timeout=5) == MCU_RESPONSE
+    try:
+        return time_per_op(round_trip)
+    finally:
+        command_queue.put(None)
+        manager.join(5)
+        manager.close()
+        device.close()
+
+
+@benchmark('e2e.hangouts_serial.sensor_poll')
+def bench_sensor_poll():
+    serialmanager = load_module('hangouts_serial', 'serialmanager')
+    sensorpoller = load_module('hangouts_serial', 'sensorpoller')
+    # one response frame per 2 byte command, batched commands arrive in one write
+    try:
+        device = PtyDevice(lambda data: MCU_RESPONSE * (len(data) // 2))
+    except (ImportError, OSError) as e:
+        raise Skip('no pty support: %s' % e)
+    command_queue = Queue()
+    manager = serialmanager.SerialManager(device.slave_name, command_queue, Queue(), eolchar=b'\xFF')
+    manager.start()
+    store = sensorpoller.ReadingStore(':memory:')
+    # batch reads of a single sensor (the default config) get a bare frame back, not a list
+    pollers = [sensorpoller.SensorPoller(sensors, command_queue, ':memory:', batch=True, timeout=5)
+               for sensors in ({'temp': b'\x01\x10'},
+                               {'temp': b'\x01\x10', 'humidity': b'\x01\x11', 'light': b'\x01\x12'})]
+    try:
+        for poller in pollers:
+            poller.poll(store)
+            for sensor in poller.sensors:
+                value = poller.latest_value(sensor)
+                assert value == MCU_RESPONSE, 'stored %r for %s' % (value, sensor)
+                assert store.since(sensor, 0)[-1][1] == MCU_RESPONSE
+        return time_per_op(lambda: pollers[0].poll(store), repeat=3)
+    finally:
+        store.close()
+        command_queue.put(None)
+        manager.join(5)
+        manager.close()
+        device.close()
+
+
+@benchmark('e2e.aquos.send_rs232_command')
+def bench_aquos_round_trip():
+    aquos_cmd = load_module('aquos_serial_control', 'aquos_cmd')
+    try:
+        device = PtyDevice(lambda command: AQUOS_RESPONSE)
+    except (ImportError, OSError) as e:
+        raise Skip('no pty support: %s' % e)
+    controller = aquos_cmd.AquosControl.__new__(aquos_cmd.AquosControl)
+    controller.ser = aquos_cmd.serial.Serial(device.slave_name, 9600, timeout=1)
+    try:
+        # each command includes the fixed 0.25 s wait, so only a few runs
+        return time_per_op(lambda: controller.send_rs232_command(aquos_cmd.CMD_POWR_STATUS), number=4, repeat=1)
+    finally:
+        controller.ser.close()
+        device.close()
+
+
+@benchmark('e2e.send_wol.send_magic_packets')
+def bench_send_magic_packets():
+    send_wol = load_module('send_wol', 'send_wol')
+    listener = UdpListener()
+    targets = [send_wol.Target(mac, '127.0.0.1', listener.port) for mac in MACS]
+    try:
+        # no pacing, so this is the per packet cost of building and sending
+        seconds = time_per_op(lambda: send_wol.send_magic_packets(targets, rate=0), number=5) / len(targets)
+        deadline = time.monotonic() + 1
+        while not listener.received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert listener.received, 'no magic packets received'
+        return seconds
+    finally:
+        listener.close()
+
+
+@benchmark('e2e.send_wol.confirm_targets')
+def bench_confirm_targets():
+    send_wol = load_module('send_wol', 'send_wol')
+    listener = TcpListener()
+    targets = [send_wol.Target(mac, '127.0.0.1', 9, '127.0.0.1') for mac in MACS[:50]]
+
+    def confirm():
+        results = asyncio.run(send_wol.confirm_targets(targets, 'tcp', listener.port, timeout=5))
+        assert all(seconds is not None for _, seconds in results)
+    try:
+        return time_per_op(confirm, repeat=3)
+    finally:
+        listener.close()
+
+
+FARCASOUP_NOTICE_SNIPPET = '''
+import datetime, json, sys, timeit
+sys.path.insert(0, sys.argv[1])
+try:
+    import farcasoup
+except ImportError as e:
+    print(json.dumps({'skipped': 'farcasoup.py: %s' % e}))
+    sys.exit()
+# the stand-in has no TLS, so no login either
+farcasoup.smtp_host, farcasoup.smtp_port, farcasoup.smtp_tls = '127.0.0.1', int(sys.argv[2]), False
+match_dates = [datetime.date(2017, 10, 1) + datetime.timedelta(days=7 * i) for i in range(int(sys.argv[3]))]
+number = int(sys.argv[4])
+seconds = timeit.Timer(lambda: farcasoup.start_notice_sender(match_dates).join()).timeit(number)
+print(json.dumps({'seconds_per_op': seconds / number}))
+'''
+
+
+@benchmark('e2e.farcasoup.send_notice')
+def bench_farcasoup_notice():
+    listener = SmtpListener()
+    matches, number = 5, 20
+    try:
+        seconds = run_farcasoup(FARCASOUP_NOTICE_SNIPPET, listener.port, matches, number)['seconds_per_op']
+    finally:
+        listener.close()
+    # one digest email per run, listing every match
+    assert len(listener.messages) == number, '%d emails sent for %d runs' % (len(listener.messages), number)
+    for _, _, data in listener.messages:
+        text = email.message_from_bytes(data).get_payload()[0].get_payload()
+        assert len(text.splitlines()) == matches, 'digest lists %d of %d matches' % (len(text.splitlines()), matches)
+    return seconds
+
+
+@benchmark('e2e.batbaby.lookup_rating')
+def bench_batbaby_lookup():
+    batbaby = load_module('batbaby', 'batbaby')
+    xml = goodreads_search_xml()
+    server = StubHTTPServer([('/search/index.xml', lambda path, query: (200, 'application/xml', xml))])
+    session = batbaby.requests.Session()
+    bucket = batbaby.TokenBucket(rate=1e9, capacity=1e9)
+    try:
+        return time_per_op(lambda: batbaby.lookup_rating(session, bucket, 'key', 'Batman', 'Someone', server.url))
+    finally:
+        session.close()
+        server.close()
+
+
+@benchmark('e2e.batbaby.lookup_ratings_by_isbn')
+def bench_batbaby_isbn_batch():
+    batbaby = load_module('batbaby', 'batbaby')
+    isbns = ['978%010d' % i for i in range(250)]
+
+    def review_counts(path, query):
+        books = [{'isbn': isbn[3:], 'isbn13': isbn, 'average_rating': '4.01'}
+                 for isbn in query['isbns'][0].split(',')]
+        return 200, 'application/json', json.dumps({'books': books}).encode()
+    server = StubHTTPServer([('/book/review_counts.json', review_counts)])
+    session = batbaby.requests.Session()
+    bucket = batbaby.TokenBucket(rate=1e9, capacity=1e9)
+
+    def lookup():
+        assert len(batbaby.lookup_ratings_by_isbn(session, bucket, 'key', isbns, server.url)) == len(isbns) * 2
+    try:
+        return time_per_op(lookup) / len(isbns)
+    finally:
+        session.close()
+        server.close()
+
+
+@benchmark('e2e.shamer.sync_messages')
+def bench_shamer_sync():
+    shamer = load_module('futsal_shamer', 'shamer')
+    bench_parse = load_module('futsal_shamer', 'bench_parse')
+    corpus = bench_parse.load_corpus()
+    # 60 distinct messages in pages of 25, like the Gmail API returns them
+    messages = {}
+    for i in range(60):
+        message = dict(corpus[i % len(corpus)], id='msg%03d' % i)
+        messages[message['id']] = json.dumps(message).encode()
+    message_ids = sorted(messages, reverse=True)
+
+    def list_messages(path, query):
+        start = int(query.get('pageToken', ['0'])[0])
+        data = {'messages': [{'id': message_id} for message_id in message_ids[start:start + 25]]}
+        if start + 25 < len(message_ids):
+            data['nextPageToken'] = str(start + 25)
+        return 200, 'application/json', json.dumps(data).encode()
+
+    def get_message(path, query):
+        body = messages.get(path.rsplit('/', 1)[1])
+        return (200, 'application/json', body) if body else (404, 'text/plain', b'not found')
+
+    server = StubHTTPServer([
+        ('/profile', lambda path, query: (200, 'application/json', b'{"historyId": "1000"}')),
+        ('/messages/', get_message),
+        ('/messages', list_messages),
+    ])
+    session = shamer.requests.Session()
+    after_date = dt.date(2000, 1, 1)
+
+    def sync():
+        state = {'history_id': None, 'messages': {}}
+        shamer.sync_messages(session, state, after_date, early_exit=False, api_url=server.url)
+        assert len(state['messages']) == len(messages)
+    try:
+        return time_per_op(sync, repeat=3) / len(messages)
+    finally:
+        session.close()
+        server.close()
+
+
+def run_benchmarks(name_filter):
+    results = {}
+    for name, func in BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+        try:
+            results[name] = {'seconds_per_op': func()}
+        except Skip as e:
+            results[name] = {'skipped': str(e)}
+        except Exception as e:  # pylint: disable=broad-except
+            results[name] = {'error': '%s: %s' % (type(e).__name__, e)}
+        print_result(name, results[name])
+    return results
+
+
+def print_result(name, result):
+    if 'skipped' in result:
+        print('%-45s skipped (%s)' % (name, result['skipped']))
+    elif 'error' in result:
+        print('%-45s ERROR (%s)' % (name, result['error']))
+    else:
+        print('%-45s %12.3f us/op' % (name, result['seconds_per_op'] * 1e6))
+
+
+def compare(results, baseline, tolerance):
+    """
+    print change against baseline for each benchmark, returns list of names that got slower than tolerance
+    """
+    regressions = []
+    print('\nCompared to baseline from %s:' % baseline.get('timestamp', '?'))
+    for name, result in sorted(results.items()):
+        old = baseline['results'].get(name, {}).get('seconds_per_op')
+        new = result.get('seconds_per_op')
+        if old is None or new is None:
+            continue
+        change = new / old - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-45s %+7.1f%%%s' % (name, change * 100, flag))
+    return regressions
+
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description='Run benchmarks and compare against a baseline.')
+    parser.add_argument('-f', '--filter',
+                        help='only run benchmarks whose name contains this text')
+    parser.add_argument('-o', '--output',
+                        default=DEFAULT_OUTPUT,
+                        help='file to write results to (default: %(default)s)')
+    parser.add_argument('-b', '--baseline',
+                        default=DEFAULT_BASELINE,
+                        help='baseline results to compare against (default: %(default)s)')
+    parser.add_argument('--save-baseline',
+                        action='store_true',
+                        help='also save results as the new baseline')
+    parser.add_argument('-t', '--tolerance',
+                        type=float, default=0.2,
+                        help='fraction slower than baseline that counts as a regression (default: %(default)s)')
+    args = parser.parse_args(arguments)
+
+    results = run_benchmarks(args.filter)
+    data = {
+        'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    write_json(args.output, data)
+    print('\nResults written to %s' % args.output)
+
+    errors = [name for name, result in results.items() if 'error' in result]
+    if errors:
+        sys.exit('%d benchmark(s) failed: %s' % (len(errors), ', '.join(sorted(errors))))
+
+    if args.save_baseline:
+        write_json(args.baseline, data)
+        print('Baseline saved to %s' % args.baseline)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit('%d benchmark(s) slower than baseline by more than %.0f%%'
+                     % (len(regressions), args.tolerance * 100))
+    else:
+        print('No baseline at %s to compare against' % args.baseline)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
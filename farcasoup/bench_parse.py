@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+benchmark farcasoup page parsing against the saved pages in fixtures/
+compares building the full page tree (old approach) with the strainer based parsers
+
+memory is measured as the growth in peak RSS while parsing the page once, in a fresh subprocess
+per case so that earlier cases don't hide it. works on python 2 (no tracemalloc there).
+"""
+
+import datetime as dt
+import os
+import subprocess
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+import farcasoup
+
+try:
+    import resource
+except ImportError:
+    # windows, no memory stats
+    resource = None
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+match_date = dt.date(2017, 10, 20)
+
+
+def full_tree_forum(html):
+    soup = BeautifulSoup(html, 'lxml')
+    return [base.find('h3', attrs={'class': 'threadtitle'}).a.string
+            for base in soup.findAll('div', attrs={'class': 'inner'})]
+
+
+def full_tree_thread(html):
+    soup = BeautifulSoup(html, 'lxml')
+    keyword_list = ['Sky Sports', 'English', '720p']
+    return [all(keyword in post.renderContents() for keyword in keyword_list)
+            for post in soup.findAll('div', attrs={'class': 'postrow has_after_content'})]
+
+
+def strainer_forum(html):
+    return list(farcasoup.parse_forum_threads(html))
+
+
+def strainer_thread(html):
+    return farcasoup.parse_thread_links(html)
+
+
+def load_fixture(name):
+    with open(os.path.join(fixtures_path, name), 'rb') as f:
+        return f.read()
+
+
+def max_rss_kib():
+    """
+    peak RSS of this process so far in KiB.
+    on linux read VmHWM, since ru_maxrss of a new process starts out at its parent's peak
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return float(line.split()[1])
+    except IOError:
+        pass
+    # ru_maxrss is KiB on linux, bytes on mac
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 if sys.platform == 'darwin' else float(rss)
+
+
+def rss_growth(func_name, fixture):
+    """
+    run in the subprocess: parse page once and print how much max RSS grew
+    """
+    html = load_fixture(fixture)
+    before = max_rss_kib()
+    globals()[func_name](html)
+    print('%.0f' % (max_rss_kib() - before))
+
+
+def measure(func, fixture, iterations):
+    """
+    returns (ms per page, peak memory growth in KiB or None)
+    """
+    html = load_fixture(fixture)
+    elapsed = timeit.timeit(lambda: func(html), number=iterations)
+    peak = None
+    if resource:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                          '--rss', func.__name__, fixture])
+        # parsers print progress messages, result is on the last line
+        peak = float(output.decode().strip().splitlines()[-1])
+    return elapsed / iterations * 1000, peak
+
+
+def main(iterations=20):
+    forum_html = load_fixture('forum_page.html')
+    thread_html = load_fixture('thread_page.html')
+
+    # check parsers still find the expected thread and links before timing them
+    assert [date for date, _, _ in strainer_forum(forum_html)].count(match_date) == 1
+    assert len(strainer_thread(thread_html)) == 4
+
+    cases = [
+        ('forum  full tree', full_tree_forum, 'forum_page.html'),
+        ('forum  strainer ', strainer_forum, 'forum_page.html'),
+        ('thread full tree', full_tree_thread, 'thread_page.html'),
+        ('thread strainer ', strainer_thread, 'thread_page.html'),
+    ]
+    for name, func, fixture in cases:
+        ms, peak = measure(func, fixture, iterations)
+        if peak is None:
+            print('%s: %.2f ms/page' % (name, ms))
+        else:
+            print('%s: %.2f ms/page, max RSS +%.0f KiB' % (name, ms, peak))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--rss':
+        rss_growth(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -2,43 +2,91 @@
 
 import calendar
 import datetime as dt
-import fileinput
+import json
+import os
 import re
 import smtplib
 import subprocess
+import threading
 import time
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from multiprocessing.pool import ThreadPool
 
 import urllib2
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+from httpcache import HttpCache
 
 username = "xxx@yyy.com"
 password = "password"
+smtp_host = 'smtp.gmail.com'
+smtp_port = 587
+# only turn off to send to a local test server. without TLS there is no login, the password is never sent in the clear
+smtp_tls = True
+
+forum_url = 'http://forum.rojadirecta.es/forumdisplay.php?15-Partidos-en-descarga-(Full-matches)/page'
+ua = 'Mozilla/5.0 (X11; Linux x86_64; rv:2.0.1) Gecko/20110506 Firefox/4.0.1'
+
+# pages are cached on disk and revalidated with conditional requests
+cache_dir = '.http_cache'
+cache_max_size = 50 * 1024 * 1024  # bytes
+cache_ttl = 10 * 60  # seconds before a cached page is revalidated
+# created on first fetch, so importing the module (eg. for the benchmarks) doesn't create cache_dir
+page_cache = None
+page_cache_lock = threading.Lock()
+
+# only build the parts of the page we need
+thread_strainer = SoupStrainer('div', attrs={'class': 'inner'})
+post_strainer = SoupStrainer('div', attrs={'class': 'postrow has_after_content'})
+
+competition_keywords = ['La Liga', 'Copa', 'UEFA Champions', 'UCL']
+thread_index_file = 'thread_index.json'
 
+date_regex = re.compile(r'(\d{2}/\d{2}/\d{4})')
+short_date_regex = re.compile(r'(\d{2}/\d{2}/\d{2})')
+ul_link_regex = re.compile(r'(http://ul.to/)')
 
-def send_notice(match_date):
+
+def send_notice(match_dates):
+    """
+    send one digest email listing every match sent to the download list this run
+    """
     msg = MIMEMultipart()
-    msg['Subject'] = 'Download Notice for Match xxx'
+    msg['Subject'] = 'Download Notice for ' + str(len(match_dates)) + ' Match(es)'
     msg['From'] = username
     msg['To'] = 'yyy@zzz.com'
 
-    text = MIMEText('Farca match date ' + str(match_date) + ' successfully sent to download list')
+    lines = ['Farca match date ' + str(match_date) + ' successfully sent to download list'
+             for match_date in match_dates]
+    text = MIMEText('\n'.join(lines))
     msg.attach(text)
 
-    s = smtplib.SMTP('smtp.gmail.com', 587)
-    s.ehlo()
-    s.starttls()
+    s = smtplib.SMTP(smtp_host, smtp_port)
     s.ehlo()
-    s.login(username, password)
+    if smtp_tls:
+        # raises SMTPException if the server doesn't offer STARTTLS, rather than falling back to plaintext
+        s.starttls()
+        s.ehlo()
+        s.login(username, password)
     s.sendmail(username, msg['To'], msg.as_string())
     print('Email notice sent!')
     s.quit()
 
 
-def create_download_job(links):
-    filename = 'myFile' + str(int(calendar.timegm(time.gmtime()))) + '.crawljob'
+def start_notice_sender(match_dates):
+    """
+    send the digest email in a background thread so the rest of the run isn't held up by SMTP.
+    returns the thread so it can be joined before exiting
+    """
+    sender = threading.Thread(target=send_notice, args=(match_dates,))
+    sender.start()
+    return sender
+
+
+def create_download_job(links, match_date):
+    filename = 'myFile' + str(int(calendar.timegm(time.gmtime()))) + '_' + match_date.strftime('%Y%m%d') + '.crawljob'
 
     f = open(filename, 'a')
     for link in links:
@@ -48,20 +96,31 @@ def create_download_job(links):
     return filename
 
 
-def update_matchlist(match_date):
-    for line in fileinput.input('matches.txt', inplace=1):
-        try:
-            if match_date == dt.datetime.strptime(line.strip().split(',')[0], '%d/%m/%Y').date():
-                print(line.replace(',0', ',1'))
-            else:
-                print(line)
-        except:
-            pass
+def update_matchlist(match_dates):
+    """
+    mark all the given matches as downloaded, then upload the matches file once
+    file is rewritten to a temp file first so it is never left half written
+    """
+    with open('matches.txt') as f:
+        lines = f.readlines()
+
+    with open('matches.txt.tmp', 'w') as f:
+        for line in lines:
+            try:
+                if dt.datetime.strptime(line.strip().split(',')[0], '%d/%m/%Y').date() in match_dates:
+                    line = line.replace(',0', ',1')
+            except ValueError:
+                pass
+            f.write(line)
+    os.rename('matches.txt.tmp', 'matches.txt')
 
     to_dropbox('matches.txt', '/')
 
 
 def get_matches():
+    """
+    get dates of all past matches that haven't been downloaded yet
+    """
     try:
         subprocess.check_call(['./dropbox_uploader.sh', 'download', 'matches.txt'])
     except:
@@ -73,16 +132,17 @@ def get_matches():
         match_list.append(row.strip().split(','))
     match_file.close()
 
+    match_dates = []
     for match in match_list:
         try:
             if dt.datetime.strptime(match[0], '%d/%m/%Y').date() < dt.datetime.now().date():
                 if match[1] == '0':
                     print(match[0])
-                    return match[0]
+                    match_dates.append(dt.datetime.strptime(match[0], '%d/%m/%Y').date())
         except:
             pass
 
-    return False
+    return match_dates
 
 
 def to_dropbox(filename, directory):
@@ -92,103 +152,190 @@ def to_dropbox(filename, directory):
         print('upload fail')
 
 
-def thread_scraper(url):
+class FetchError(Exception):
+    pass
+
+
+def get_page_cache():
+    global page_cache
+    # pages are fetched from several pool workers at once
+    with page_cache_lock:
+        if page_cache is None:
+            page_cache = HttpCache(cache_dir, max_size=cache_max_size, ttl=cache_ttl)
+    return page_cache
+
+
+def fetch_page(url):
     """
-    scrape thread for Sky Sports HD links on ul.to
+    download page html (or get it from the cache if it hasn't changed)
+    raises FetchError on failure. pages are fetched in pool workers, so don't exit() here -
+    a worker that exits leaves ThreadPool.imap waiting forever. imap re-raises the error in the main thread instead.
     """
-
-    ua = 'Mozilla/5.0 (X11; Linux x86_64; rv:2.0.1) Gecko/20110506 Firefox/4.0.1'
     req = urllib2.Request(url)
     req.add_header('User-Agent', ua)
 
     try:
-        html = (urllib2.urlopen(req)).read()
-    except BaseException:
-        print('Failed to read URL.')
-        exit(1)
+        return get_page_cache().fetch(req)
+    except Exception as e:
+        raise FetchError('%s (%s)' % (url, e))
 
-    soup = BeautifulSoup(html)
-    search = soup.findAll('div', attrs={'class': 'postrow has_after_content'})
-    index = 1
 
-    links = False
+def parse_thread_links(html):
+    """
+    parse thread page for Sky Sports HD links on ul.to
+    only the post nodes are built, rest of the page is skipped by the strainer
+    """
+    soup = BeautifulSoup(html, 'lxml', parse_only=post_strainer)
+    search = soup.find_all('div', attrs={'class': 'postrow has_after_content'})
 
     keyword_list = ['Sky Sports', 'English', '720p']
 
-    for post in search:
+    # skip first post since it usually just has quotes of future posts and is annoying to parse
+    for post in search[1:]:
+        text = post.get_text()
+        if all(keyword in text for keyword in keyword_list):
+            print('===============found keywords===========')
+            # found the post we're looking for
+            raw_links = post.find_all('a', href=True, text=ul_link_regex)
+            links = [link.get('href') for link in raw_links]
 
-        print('-----------------POST START---------------')
+            if links:
+                return links
 
-        if index == 1:
-            # skip first post since it usually just has quotes of future posts and is annoying to parse
-            pass
-        elif index > 1:
-            if all(keyword in post.renderContents() for keyword in keyword_list):
-                print('===============found keywords===========')
-                # found the post we're looking for
+    return False
+
+
+def thread_scraper(url):
+    """
+    scrape thread for Sky Sports HD links on ul.to
+    """
+    return parse_thread_links(fetch_page(url))
 
-                # print post number
-                # print 'Index:' + str(index)
 
-                raw_links = post.findAll('a', href=True, text=re.compile(r'(http://ul.to/)'))
-                links = [link.get('href') for link in raw_links]
+def title_date(title):
+    """
+    get match date from thread title, trying dd/mm/yyyy first then dd/mm/yy
+    """
+    match = date_regex.search(title)
+    if match:
+        return dt.datetime.strptime(match.group(1), '%d/%m/%Y').date()
 
-                if links:
-                    return links
+    match = short_date_regex.search(title)
+    if match:
+        return dt.datetime.strptime(match.group(1), '%d/%m/%y').date()
 
-        index += 1
+    return None
+
+
+def title_competition(title):
+    """
+    get competition from thread title, or None if it's not one we want
+    """
+    for keyword in competition_keywords:
+        if keyword in title:
+            return keyword
 
-    return links
+    return None
 
 
-def forum_scraper(url, matchdate):
-    """ 
-    scrape forum index to find match thread for given match date (if it exists)
+def parse_forum_threads(html):
     """
+    parse forum index page for Barcelona match threads
+    yields (match date, title, thread url) for each one found
+    only the thread title nodes are built, rest of the page is skipped by the strainer
+    """
+    soup = BeautifulSoup(html, 'lxml', parse_only=thread_strainer)
+
+    for base in soup.find_all('div', attrs={'class': 'inner'}):
+        thread_link = base.find('h3', attrs={'class': 'threadtitle'}).a
+        title = thread_link.string
+
+        if title and title.startswith('FUTBOL'):
+            if title_competition(title) and 'Barcelona' in title:
+                date = title_date(title)
+                if date:
+                    yield date, title, 'http://forum.rojadirecta.es/' + thread_link.get('href').encode('latin-1')
 
-    ua = 'Mozilla/5.0 (X11; Linux x86_64; rv:2.0.1) Gecko/20110506 Firefox/4.0.1'
-    req = urllib2.Request(url)
-    req.add_header('User-Agent', ua)
 
+def load_thread_index():
+    """
+    load index of thread url -> {date, competition, title, seq} saved by previous runs
+    seq is the thread's position in the forum listing (lower is nearer page 1), used to pick between threads
+    for the same date since the index itself has no order
+    """
     try:
-        html = (urllib2.urlopen(req)).read()
-    except BaseException:
-        print('Failed to read URL.')
-        exit(1)
-
-    soup = BeautifulSoup(html)
-    search = soup.findAll('div', attrs={'class': 'inner'})
-    index = 1
-    keyword_list = ['La Liga', 'Copa', 'UEFA Champions', 'UCL']
-    found_thread = False
-
-    for base in search:
-        title = base.find('h3', attrs={'class': 'threadtitle'}).a.string
-        details = base.find('div', attrs={'class': 'author'}).span.a['title']
-
-        if title:
-            if title.startswith('FUTBOL'):
-                if any(keyword in title for keyword in keyword_list) and 'Barcelona' in title:
-                    match = re.search(r'(\d{2}/\d{2}/\d{4})', title)
-                    if match:
-                        date = dt.datetime.strptime(match.group(1), '%d/%m/%Y').date()
-                        if date == match_date:
-                            print(title.encode('latin-1'))
-                            found_thread = 'http://forum.rojadirecta.es/' + base.find('h3', attrs={
-                                'class': 'threadtitle'}).a.get('href').encode('latin-1')
-                            break
-
-                    match = re.search(r'(\d{2}/\d{2}/\d{2})', title)
-                    if match:
-                        date = dt.datetime.strptime(match.group(1), '%d/%m/%y').date()
-                        if date == match_date:
-                            found_thread = 'http://forum.rojadirecta.es/' + base.find('h3', attrs={
-                                'class': 'threadtitle'}).a.get('href').encode('latin-1')
-                            break
-
-        index += 1
-
-    return found_thread
+        with open(thread_index_file) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_thread_index(index):
+    with open(thread_index_file + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.rename(thread_index_file + '.tmp', thread_index_file)
+
+
+def update_thread_index(index, pages=range(1, 25), workers=8, window=3):
+    """
+    add new match threads to the index, scanning forum pages from page 1.
+    old threads never change, so the scan stops after the first page that has a thread already in the index.
+    pages are fetched concurrently: all of them when the index is empty, otherwise `window` pages at a time
+    since a normal run only needs the first page or two.
+    new threads are above all the indexed ones in the listing, so they are numbered before them.
+    returns number of threads added
+    """
+    def page_threads(n):
+        return list(parse_forum_threads(fetch_page(forum_url + str(n))))
+
+    pages = list(pages)
+    if not index:
+        window = len(pages)
+    new_threads = []
+    new_urls = set()
+    pool = ThreadPool(max(min(workers, window), 1))
+    try:
+        reached_indexed = False
+        for start in range(0, len(pages), window):
+            # pages are checked in order, later pages of the window are dropped once the index is reached
+            for threads in pool.imap(page_threads, pages[start:start + window]):
+                for date, title, thread_url in threads:
+                    if thread_url in index:
+                        reached_indexed = True
+                        continue
+                    # a thread can show up twice if the listing moves while it's being scanned
+                    if thread_url in new_urls:
+                        continue
+                    new_urls.add(thread_url)
+                    new_threads.append((thread_url, {
+                        'date': date.strftime('%Y%m%d'),
+                        'competition': title_competition(title),
+                        'title': title,
+                    }))
+                if reached_indexed:
+                    break
+            if reached_indexed:
+                break
+    finally:
+        pool.terminate()
+
+    first_seq = min([entry.get('seq', 0) for entry in index.values()] or [0]) - len(new_threads)
+    for seq, (thread_url, entry) in enumerate(new_threads, first_seq):
+        entry['seq'] = seq
+        index[thread_url] = entry
+
+    return len(new_threads)
+
+
+def threads_by_date(index):
+    """
+    returns dict of match date -> thread url
+    if there is more than one thread for a date, the one nearest the top of the forum listing is used
+    """
+    found_threads = {}
+    for thread_url, entry in sorted(index.items(), key=lambda item: (item[1].get('seq', 0), item[0])):
+        found_threads.setdefault(dt.datetime.strptime(entry['date'], '%Y%m%d').date(), thread_url)
+    return found_threads
 
 
 def print_start_message():
@@ -199,31 +346,42 @@ def print_start_message():
 if __name__ == '__main__':
     print_start_message()
 
-    match_date = get_matches()
-    if match_date:
-        match_date = dt.datetime.strptime(match_date, '%d/%m/%Y').date()
-
-    found_thread = False
-    if match_date:
-        for n in range(1, 25):
-            found_thread = forum_scraper(
-                'http://forum.rojadirecta.es/forumdisplay.php?15-Partidos-en-descarga-(Full-matches)/page' + str(n),
-                match_date)
-            if found_thread:
-                print(found_thread)
-                break
-
-    found_links = False
-    if found_thread:
-        found_links = thread_scraper(found_thread)
-
+    match_dates = get_matches()
+    found_threads = {}
+    if match_dates:
+        thread_index = load_thread_index()
+        try:
+            # index isn't saved if a page fails, otherwise the next run would stop before the missed pages
+            if update_thread_index(thread_index):
+                save_thread_index(thread_index)
+        except FetchError as e:
+            print('Failed to read URL: ' + str(e))
+            exit(1)
+        found_threads = threads_by_date(thread_index)
+    else:
+        print('no matches to download')
+
+    downloaded = []
+    for match_date in match_dates:
+        found_thread = found_threads.get(match_date)
+        if not found_thread:
+            print('no match thread found for ' + str(match_date))
+            continue
+
+        print(found_thread)
+        try:
+            found_links = thread_scraper(found_thread)
+        except FetchError as e:
+            print('Failed to read URL: ' + str(e))
+            continue
         if found_links:
-            filename = create_download_job(found_links)
+            filename = create_download_job(found_links, match_date)
             to_dropbox(filename, '/fw')
-            update_matchlist(match_date)
-            send_notice(match_date)
-        elif not found_links:
+            downloaded.append(match_date)
+        else:
             print('found match thread but not links')
 
-    elif not found_thread:
-        print('no match thread found')
+    if downloaded:
+        notice_sender = start_notice_sender(downloaded)
+        update_matchlist(downloaded)
+        notice_sender.join()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+on-disk http cache for page fetches
+
+bodies are stored along with their ETag/Last-Modified headers so that stale pages
+can be revalidated with a conditional request (a 304 is served from disk).
+pages fetched less than `ttl` seconds ago are served from disk without any request.
+total size of cached bodies is capped at `max_size` bytes, least recently used pages are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import urllib2
+
+
+class HttpCache(object):
+
+    def __init__(self, path, max_size=50 * 1024 * 1024, ttl=600):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        # pages are fetched from several threads at once
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.index_file = os.path.join(path, 'index.json')
+        try:
+            with open(self.index_file) as f:
+                self.index = json.load(f)
+        except (IOError, ValueError):
+            self.index = {}
+
+    def body_file(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def read_body(self, url):
+        try:
+            with open(self.body_file(url), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def fetch(self, req):
+        """
+        fetch urllib2.Request, going through the cache
+        """
+        url = req.get_full_url()
+        with self.lock:
+            entry = self.index.get(url)
+        body = self.read_body(url) if entry else None
+
+        if body is not None:
+            if time.time() - entry['fetched'] < self.ttl:
+                self.touch(url)
+                return body
+            if entry.get('etag'):
+                req.add_header('If-None-Match', entry['etag'])
+            if entry.get('last_modified'):
+                req.add_header('If-Modified-Since', entry['last_modified'])
+
+        try:
+            resp = urllib2.urlopen(req)
+        except urllib2.HTTPError as e:
+            if e.code == 304 and body is not None:
+                # not modified, use body from disk
+                self.touch(url, fetched=True)
+                return body
+            raise
+
+        body = resp.read()
+        headers = resp.info()
+        self.store(url, body, headers.get('ETag'), headers.get('Last-Modified'))
+        return body
+
+    def touch(self, url, fetched=False):
+        with self.lock:
+            entry = self.index.get(url)
+            if entry:
+                entry['last_used'] = time.time()
+                if fetched:
+                    entry['fetched'] = entry['last_used']
+                self.save_index()
+
+    def store(self, url, body, etag=None, last_modified=None):
+        with open(self.body_file(url), 'wb') as f:
+            f.write(body)
+
+        now = time.time()
+        with self.lock:
+            self.index[url] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'size': len(body),
+                'fetched': now,
+                'last_used': now,
+            }
+            self.evict()
+            self.save_index()
+
+    def evict(self):
+        """
+        remove least recently used pages until total size is under max_size
+        """
+        total = sum(entry['size'] for entry in self.index.values())
+        for url, entry in sorted(self.index.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_size:
+                break
+            total -= entry['size']
+            del self.index[url]
+            try:
+                os.remove(self.body_file(url))
+            except OSError:
+                pass
+
+    def save_index(self):
+        # write to temp file first so a crash doesn't leave a half written index
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f)
+        os.rename(tmp_file, self.index_file)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the email parsing stage of futsal_shamer against the .eml fixture corpus.
+
+Each fixture is converted into the message format returned by the Gmail API (format=full) and then run through
+extract_event_dates. Extracted dates are checked against fixtures/expected.json before timing.
+"""
+
+# Standard Library
+import base64
+import email
+import json
+import os.path
+import time
+import tracemalloc
+from email.utils import parsedate_to_datetime
+# Third party
+import click
+# Local
+from shamer import extract_event_dates
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def to_gmail_payload(part):
+    """Convert email.message.Message into Gmail API payload dict."""
+    if part.is_multipart():
+        return {'mimeType': part.get_content_type(), 'parts': [to_gmail_payload(p) for p in part.get_payload()]}
+    data = base64.urlsafe_b64encode(part.get_payload(decode=True) or b'').decode()
+    return {'mimeType': part.get_content_type(), 'body': {'data': data}}
+
+
+def load_fixture(path):
+    """Load .eml file as a Gmail API message dict."""
+    with open(path, 'rb') as f:
+        msg = email.message_from_bytes(f.read())
+    internal_date = int(parsedate_to_datetime(msg['Date']).timestamp() * 1000)
+    return {'id': os.path.basename(path), 'internalDate': str(internal_date), 'payload': to_gmail_payload(msg)}
+
+
+def load_corpus(fixtures_path=FIXTURES_PATH):
+    names = sorted(name for name in os.listdir(fixtures_path) if name.endswith('.eml'))
+    return [load_fixture(os.path.join(fixtures_path, name)) for name in names]
+
+
+def check_corpus(messages, fixtures_path=FIXTURES_PATH):
+    """Check that event dates extracted from each fixture match the expected dates."""
+    with open(os.path.join(fixtures_path, 'expected.json')) as f:
+        expected = json.load(f)
+    failures = []
+    for message in messages:
+        dates = [date.strftime('%Y%m%d') for date in extract_event_dates(message)]
+        if dates != expected.get(message['id'], []):
+            failures.append(f'{message["id"]}: got {dates}, expected {expected.get(message["id"], [])}')
+    return failures
+
+
+def run_benchmark(messages, iterations):
+    """Parse whole corpus `iterations` times. Returns (messages/sec, peak memory in bytes)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in messages:
+            for _ in extract_event_dates(message):
+                pass
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(messages) * iterations / elapsed, peak
+
+
+@click.command()
+@click.option('--iterations', '-n', default=200, help='Number of times to parse the corpus.')
+@click.option('--fixtures-path', type=click.Path(exists=True), default=FIXTURES_PATH,
+              help='Directory containing .eml fixtures and expected.json.')
+def main(iterations, fixtures_path):
+    messages = load_corpus(fixtures_path)
+    failures = check_corpus(messages, fixtures_path)
+    if failures:
+        raise click.ClickException('Parse results differ from expected:\n' + '\n'.join(failures))
+
+    rate, peak = run_benchmark(messages, iterations)
+    print(f'{len(messages)} fixtures x {iterations} iterations')
+    print(f'{rate:,.0f} messages/sec, peak memory {peak / 1024:,.1f} KiB')
+
+
+if __name__ == '__main__':
+    main()
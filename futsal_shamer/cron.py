@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Minimal cron expression support for scheduling checks in daemon mode.
+
+Supports the standard five fields (minute hour day-of-month month day-of-week) with '*', lists, ranges and steps,
+eg. '0 21 * * 0,3' or '*/30 8-22 * * *'. Day-of-week is 0-7 where both 0 and 7 are Sunday.
+"""
+
+# Standard Library
+import datetime as dt
+
+FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def parse_field(field, low, high):
+    """Get set of values matched by a single cron field."""
+    values = set()
+    for item in field.split(','):
+        value_range, _, step = item.partition('/')
+        if value_range == '*':
+            start, end = low, high
+        elif '-' in value_range:
+            start, end = (int(value) for value in value_range.split('-', 1))
+        else:
+            start = int(value_range)
+            end = high if step else start
+        if not low <= start <= end <= high:
+            raise ValueError(f'Invalid cron field: {field}')
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+class CronSchedule:
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression should have 5 fields: {expression}')
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES))
+        # Cron uses 0 or 7 for Sunday, convert to Python's Monday = 0.
+        self.weekdays = {(weekday - 1) % 7 for weekday in weekdays}
+        # If both day fields are restricted then a day matching either of them is OK (same as cron).
+        # Like Vixie cron, a field starting with '*' (eg. '*/2') doesn't count as restricted.
+        self.day_or_weekday = not fields[2].startswith('*') and not fields[4].startswith('*')
+
+    def matches_day(self, date):
+        day_match = date.day in self.days
+        weekday_match = date.weekday() in self.weekdays
+        if self.day_or_weekday:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_run(self, after):
+        """Get datetime of the first scheduled run after the given datetime."""
+        next_dt = after.replace(second=0, microsecond=0) + dt.timedelta(minutes=1)
+        # Skip whole days/hours at a time where possible. Give up after a few years (eg. '0 0 31 2 *').
+        limit = next_dt + dt.timedelta(days=366 * 5)
+        while next_dt < limit:
+            if next_dt.month not in self.months or not self.matches_day(next_dt):
+                next_dt = next_dt.replace(hour=0, minute=0) + dt.timedelta(days=1)
+            elif next_dt.hour not in self.hours:
+                next_dt = next_dt.replace(minute=0) + dt.timedelta(hours=1)
+            elif next_dt.minute not in self.minutes:
+                next_dt += dt.timedelta(minutes=1)
+            else:
+                return next_dt
+        raise ValueError('Cron expression never matches.')
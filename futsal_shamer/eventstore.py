@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Standard Library
+import datetime as dt
+import logging
+import os.path
+import sqlite3
+
+
+class EventStore:
+    """Persistent store of attended event dates from all sources (league fixtures, emails, manual entries).
+
+    Dates are stored as YYYYMMDD strings in an indexed SQLite table, so that checking for the latest event
+    or for any event in a date range doesn't need to read every date.
+    Each event is keyed by (source, ref, date) so adding the same event again is a no-op.
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS events (
+                date TEXT NOT NULL,
+                source TEXT NOT NULL,
+                ref TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (source, ref, date)
+            );
+            CREATE INDEX IF NOT EXISTS events_date ON events (date);
+            CREATE TABLE IF NOT EXISTS dates_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+        ''')
+
+    def add(self, date, source, ref=''):
+        self.add_many([date], source, ref)
+
+    def add_many(self, dates, source, ref=''):
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO events (date, source, ref) VALUES (?, ?, ?)',
+                                ((date.strftime('%Y%m%d'), source, ref) for date in dates))
+
+    def import_dates_file(self, path, source):
+        """Add dates from a text file with one YYYYMMDD date per line (eg. soccer.txt).
+        The file is only read if its size or modification time has changed since the last import. Dates are
+        stored with the file path as ref, and replace all the dates from the previous import, so that dates
+        removed from or corrected in the file (or a line that was only half written last time) don't linger.
+        """
+        if not os.path.isfile(path):
+            return
+        stat = os.stat(path)
+        row = self.db.execute('SELECT size, mtime_ns FROM dates_files WHERE path = ?', (path,)).fetchone()
+        if row == (stat.st_size, stat.st_mtime_ns):
+            return
+
+        with open(path, 'rb') as f:
+            lines = f.read().decode().splitlines()
+        dates = set()
+        for line in lines:
+            date_str = line.strip()
+            if date_str:
+                try:
+                    dates.add(dt.datetime.strptime(date_str, '%Y%m%d').date())
+                except ValueError:
+                    logging.warning('Ignoring invalid date in %s: %s', path, date_str)
+
+        with self.db:
+            self.db.execute('DELETE FROM events WHERE source = ? AND ref = ?', (source, path))
+            self.db.executemany('INSERT OR IGNORE INTO events (date, source, ref) VALUES (?, ?, ?)',
+                                ((date.strftime('%Y%m%d'), source, path) for date in dates))
+            self.db.execute('INSERT OR REPLACE INTO dates_files (path, size, mtime_ns) VALUES (?, ?, ?)',
+                            (path, stat.st_size, stat.st_mtime_ns))
+        logging.debug('Imported %s dates from %s.', len(dates), path)
+
+    def latest_before(self, date=None):
+        """Get date of the latest event before the given date (or latest of all events), or None."""
+        if date is None:
+            row = self.db.execute('SELECT MAX(date) FROM events').fetchone()
+        else:
+            row = self.db.execute('SELECT MAX(date) FROM events WHERE date < ?', (date.strftime('%Y%m%d'),)).fetchone()
+        return dt.datetime.strptime(row[0], '%Y%m%d').date() if row[0] else None
+
+    def has_event_between(self, start, end=None):
+        """Check whether there is an event on or after start, and before end if given."""
+        if end is None:
+            query, params = 'SELECT 1 FROM events WHERE date >= ? LIMIT 1', (start.strftime('%Y%m%d'),)
+        else:
+            query = 'SELECT 1 FROM events WHERE date >= ? AND date < ? LIMIT 1'
+            params = (start.strftime('%Y%m%d'), end.strftime('%Y%m%d'))
+        return self.db.execute(query, params).fetchone() is not None
+
+    def close(self):
+        self.db.close()
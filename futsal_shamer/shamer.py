@@ -4,48 +4,245 @@
 # Standard Library
 import base64
 import datetime as dt
-import email
 import json
 import logging
 import os.path
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from configparser import ConfigParser
+from itertools import islice
 from pathlib import Path
+from threading import Event
 from time import sleep
 # Third party
 import click
 import requests
 from google_auth import GoogleAuth
 from hangoutsclient import HangoutsClient
+from sleekxmpp.exceptions import IqError, IqTimeout
+# Local
+from cron import CronSchedule
+from eventstore import EventStore
 
 APP_NAME = 'futsal_shamer'
+# Max seconds to wait for Hangouts session to be ready, or for sent messages to be acknowledged.
+HANGOUTS_READY_TIMEOUT = 30
+GMAIL_API_URL = 'https://www.googleapis.com/gmail/v1/users/me'
+# Only request the message body parts, not the headers etc. Fields masks can't recurse, so nest parts() deep enough
+# for the MIME trees seen in practice (eg. mixed > alternative > related > html).
+MESSAGE_PART_DEPTH = 6
+MESSAGE_PARTS = 'mimeType,body/data' + ',parts(mimeType,body/data' * MESSAGE_PART_DEPTH + ')' * MESSAGE_PART_DEPTH
+MESSAGE_FIELDS = f'id,internalDate,payload({MESSAGE_PARTS})'
+TAG_PATTERN = re.compile('<[^<]+?>')
+# Futsal event date follows one of these prefixes, eg. 日程：10/12
+EVENT_DATE_PREFIXES = ('第１希望', '日程')
+EVENT_DATE_PATTERN = re.compile(rf'(?:{"|".join(EVENT_DATE_PREFIXES)})：(\d{{1,2}}/\d{{1,2}})')
+
+
+def load_sync_state(cache_path):
+    """Get Gmail sync state saved by the last run.
+    State holds the last seen Gmail historyId, and for each processed message its email date and the
+    event dates extracted from it (all dates in YYYYMMDD format).
+    """
+    try:
+        with open(os.path.join(cache_path, 'gmail_sync.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {'history_id': None, 'messages': {}}
+
+
+def write_sync_state(cache_path, state):
+    with open(os.path.join(cache_path, 'gmail_sync.json'), 'w') as f:
+        json.dump(state, f)
+
+
+def get_history_id(session, api_url=GMAIL_API_URL):
+    """Get the current historyId of the mailbox."""
+    resp = session.get(f'{api_url}/profile')
+    return resp.json()['historyId']
 
 
-def get_soccer_dates(config_path):
-    """Generator that returns datetime object for each soccer match date found in local file.
-    soccer.txt should have match dates in YYYYMMDD format with each on a new line.
+def iter_message_ids(session, query, api_url=GMAIL_API_URL):
+    """Generator that returns IDs of messages matching the given Gmail search query, newest first.
+    Pages of results are only requested as they are needed.
     """
-    with open(os.path.join(config_path, 'soccer.txt')) as f:
-        soccer_dates = f.readlines()
-    for date_str in soccer_dates:
-        yield dt.datetime.strptime(date_str.strip(), '%Y%m%d').date()
+    params = {'q': query}
+    while True:
+        resp = session.get(f'{api_url}/messages', params=params)
+        data = resp.json()
+        for message in data.get('messages', []):
+            yield message['id']
+        if 'nextPageToken' not in data:
+            return
+        params['pageToken'] = data['nextPageToken']
 
 
-def get_last_date(cache_path):
-    """Get the date of last attended event from the last time this script was run.
+def has_event_since(state, after_str):
+    """Check whether any processed message has an event date on or after after_str (YYYYMMDD)."""
+    return any(event >= after_str for record in state['messages'].values() for event in record['events'])
+
+
+def list_new_message_ids(session, history_id, api_url=GMAIL_API_URL):
+    """Get IDs of messages added since history_id using the Gmail history API.
+    Returns tuple of (message IDs, latest historyId), or None if history_id has expired.
     """
-    try:
-        with open(os.path.join(cache_path, 'last_date')) as f:
-            last_date = f.read().strip()
-    except IOError as e:
-        # TODO: better return value
+    params = {'startHistoryId': history_id, 'historyTypes': 'messageAdded'}
+    message_ids = []
+    while True:
+        resp = session.get(f'{api_url}/history', params=params)
+        if resp.status_code != 200:
+            # Gmail returns 404 when startHistoryId is too old, in which case need to do a full scan.
+            logging.info('Unable to get history since %s (HTTP %s).', history_id, resp.status_code)
+            return None
+        data = resp.json()
+        for record in data.get('history', []):
+            message_ids.extend(added['message']['id'] for added in record.get('messagesAdded', []))
+        if 'nextPageToken' not in data:
+            return message_ids, data['historyId']
+        params['pageToken'] = data['nextPageToken']
+
+
+def sync_messages(session, state, after_date, workers=8, sender=None, subject=None, early_exit=True,
+                  api_url=GMAIL_API_URL):
+    """Fetch messages not processed on previous runs and record their event dates in state.
+    Uses the history API when possible, falling back to a full scan of booking emails received after after_date.
+    A full scan goes through messages newest first and, if early_exit is set, stops as soon as an event
+    on or after after_date is found since that's enough to know there's no need to shame.
+    A scan that stopped early hasn't seen the older messages, so the historyId isn't saved in that case
+    (the history API would never return those messages) and the next run does a full scan again.
+    Likewise if any message fails to fetch: a full scan is done again next run, or when using the history API
+    the previous historyId is kept so that the failed messages are listed again.
+    Messages received before after_date are dropped from state.
+    """
+    after_str = after_date.strftime('%Y%m%d')
+    new_messages = None
+    if state['history_id']:
+        new_messages = list_new_message_ids(session, state['history_id'], api_url)
+    if new_messages is None:
+        logging.debug('Doing full scan of messages since %s.', after_date)
+        # Get historyId before listing so that messages arriving in between aren't missed next time.
+        history_id = get_history_id(session, api_url)
+        message_ids = iter_message_ids(session, build_search_query(after_date, sender, subject), api_url)
+    else:
+        # Always process all new messages, since they may contain bookings for future events.
+        early_exit = False
+        message_ids, history_id = new_messages
+        if message_ids:
+            # History can't be searched, so only fetch the new messages that the booking email search also finds.
+            booking_ids = set(iter_message_ids(session, build_search_query(after_date, sender, subject), api_url))
+            message_ids = [message_id for message_id in message_ids if message_id in booking_ids]
+
+    message_ids = (message_id for message_id in message_ids if message_id not in state['messages'])
+    complete = False
+    failed = False
+    while not (early_exit and has_event_since(state, after_str)):
+        # Fetch in batches of one message per worker so can stop early without fetching everything.
+        batch = list(islice(message_ids, workers))
+        if not batch:
+            complete = True
+            break
+        logging.debug('Fetching %s new messages.', len(batch))
+        fetched = 0
+        for message in fetch_messages(session, batch, workers=workers, api_url=api_url):
+            email_date = dt.datetime.fromtimestamp(int(message['internalDate'])/1000).date()
+            state['messages'][message['id']] = {
+                'date': email_date.strftime('%Y%m%d'),
+                'events': [date.strftime('%Y%m%d') for date in extract_event_dates(message)],
+            }
+            fetched += 1
+        failed = failed or fetched < len(batch)
+
+    state['messages'] = {message_id: record for message_id, record in state['messages'].items()
+                         if record['date'] >= after_str}
+    if complete and not failed:
+        state['history_id'] = history_id
+    elif new_messages is None:
+        state['history_id'] = None
+    else:
+        logging.warning('Failed to fetch some new messages, will try again next run.')
+    return state
+
+
+def build_search_query(after_date, sender=None, subject=None):
+    """Build Gmail search query for booking emails received after the given date.
+    Only emails containing one of the event date prefixes are matched, others can't have any event dates.
+    """
+    prefixes = ' '.join(f'"{prefix}"' for prefix in EVENT_DATE_PREFIXES)
+    query = f'after:{after_date.strftime("%Y/%m/%d")} {{{prefixes}}}'
+    if sender:
+        query += f' from:{sender}'
+    if subject:
+        query += f' subject:"{subject}"'
+    return query
+
+
+def fetch_message(session, message_id, api_url=GMAIL_API_URL):
+    """Fetch body parts of a single message. Returns None if the request failed.
+    Only the fields needed to extract event dates are requested (no headers or attachments).
+    If the response has no payload at all, the whole message is fetched instead.
+    """
+    resp = session.get(f'{api_url}/messages/{message_id}', params={'format': 'full', 'fields': MESSAGE_FIELDS})
+    if resp.status_code != 200:
+        logging.warning('Failed to fetch message %s (HTTP %s).', message_id, resp.status_code)
+        return None
+    message = json.loads(resp.text)  # requests' json() method seems to have issues handling this response.
+    if 'payload' in message:
+        return message
+
+    logging.info('No payload in message %s within fields mask, fetching full message.', message_id)
+    resp = session.get(f'{api_url}/messages/{message_id}', params={'format': 'full'})
+    if resp.status_code != 200:
+        logging.warning('Failed to fetch message %s (HTTP %s).', message_id, resp.status_code)
         return None
-    return last_date
+    return json.loads(resp.text)
 
 
-def write_last_date(cache_path, last_event_str):
-    with open(os.path.join(cache_path, 'last_date'), 'w') as f:
-        f.write(last_event_str)
+def fetch_messages(session, message_ids, workers=8, api_url=GMAIL_API_URL):
+    """Generator that fetches messages concurrently over a shared session and yields them as they arrive."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_message, session, message_id, api_url) for message_id in message_ids]
+        for future in as_completed(futures):
+            message = future.result()
+            if message is not None:
+                yield message
+
+
+def iter_part_texts(payload):
+    """Generator that decodes and returns the text of each text part in a Gmail message payload.
+    Plain text parts are returned before HTML parts, and each part is only decoded when requested.
+    """
+    text_parts = []
+    parts = [payload]
+    while parts:
+        part = parts.pop()
+        parts.extend(reversed(part.get('parts', [])))
+        if part.get('mimeType') in ('text/plain', 'text/html') and part.get('body', {}).get('data'):
+            text_parts.append(part)
+    text_parts.sort(key=lambda part: part['mimeType'] != 'text/plain')
+
+    for part in text_parts:
+        data = part['body']['data']
+        text = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)).decode('utf-8', errors='replace')
+        if part['mimeType'] == 'text/html':
+            # Strip html tags (see http://stackoverflow.com/a/4869782).
+            text = TAG_PATTERN.sub('', text)
+        yield text
+
+
+def extract_event_dates(message):
+    """Generator that returns date object for each futsal event date found in a Gmail message."""
+    email_dt = dt.datetime.fromtimestamp(int(message['internalDate'])/1000)  # Google gives epoch in ms.
+    for text in iter_part_texts(message['payload']):
+        date_strs = EVENT_DATE_PATTERN.findall(text)
+        for date_str in date_strs:
+            try:
+                # Confirmation email doesn't include the year, so assume the year from email timestamp.
+                yield dt.datetime.strptime(date_str, '%m/%d').replace(year=email_dt.year).date()
+            except ValueError:
+                pass
+        if date_strs:
+            # Plain text and HTML parts contain the same dates, so no need to check the rest.
+            return
 
 
 def parse_loglevel(ctx, param, log_level_str):
@@ -82,6 +279,194 @@ def create_dir(ctx, param, directory):
     return directory
 
 
+class HangoutsSession:
+    """Hangouts session that is only connected when there is something to send, and can then be reused."""
+
+    def __init__(self, config, cache_path):
+        self.client_id = config.get('Hangouts', 'client_id')
+        self.client_secret = config.get('Hangouts', 'client_secret')
+        self.refresh_token = os.path.join(cache_path, 'hangouts_refresh_token')
+        if not os.path.isfile(self.refresh_token):
+            Path(self.refresh_token).touch()
+        self.hangouts = None
+
+    def connect(self):
+        hangouts = HangoutsClient(self.client_id, self.client_secret, self.refresh_token)
+        hangouts.register_plugin('xep_0199')  # XMPP Ping, used to check that messages have been sent.
+        # Roster is requested on session start, so once it has arrived the session is ready to send to.
+        roster_ready = Event()
+        hangouts.add_event_handler('roster_update', lambda iq: roster_ready.set())
+        if not hangouts.connect():
+            logging.error('Unable to connect to Hangouts.')
+            return False
+        hangouts.process(block=False)
+        if not roster_ready.wait(HANGOUTS_READY_TIMEOUT):
+            logging.warning('Hangouts roster not received after %s seconds, sending anyway.', HANGOUTS_READY_TIMEOUT)
+        self.hangouts = hangouts
+        return True
+
+    def is_alive(self):
+        """Check that the connected session still answers a ping (the stream may have dropped in daemon mode)."""
+        try:
+            self.hangouts['xep_0199'].ping(timeout=HANGOUTS_READY_TIMEOUT)
+        except (IqError, IqTimeout):
+            return False
+        return True
+
+    def send(self, message, recipients=None):
+        """Send message to the given Hangouts IDs, or to all contacts if none are given.
+        A session kept from an earlier send is checked first, and replaced with a new one if it has gone away.
+        """
+        if self.hangouts is not None and not self.is_alive():
+            logging.warning('Hangouts session not responding, reconnecting.')
+            self.hangouts.disconnect(wait=False)
+            self.hangouts = None
+        if self.hangouts is None and not self.connect():
+            return
+        if recipients:
+            for recipient in recipients:
+                self.hangouts.send_message(mto=recipient, mbody=message, mtype='chat')
+        else:
+            self.hangouts.send_to_all(message)
+        logging.info('Finished sending message.')
+
+    def disconnect(self):
+        if self.hangouts is None:
+            return
+        # Server handles stanzas in order, so once the ping is answered the messages have been received.
+        try:
+            self.hangouts['xep_0199'].ping(timeout=HANGOUTS_READY_TIMEOUT)
+        except (IqError, IqTimeout):
+            logging.warning('No reply to ping before disconnecting.')
+        self.hangouts.disconnect(wait=True)
+        self.hangouts = None
+
+
+class Shamer:
+    """Checks a Gmail account for recently attended events and builds the shaming message.
+
+    Gmail auth state and the Gmail HTTP session are kept between checks, so that in daemon mode each scheduled
+    check only costs the Gmail delta rather than a fresh set of handshakes.
+    When checking for a player in team mode, settings in the player's config section override the defaults
+    and state is kept in a per-player subdirectory of cache_path.
+    """
+
+    def __init__(self, config, config_path, cache_path, cut_off, workers=8, player=None, adapter=None):
+        section = config[player] if player else config['Gmail']
+        self.cache_path = os.path.join(cache_path, player) if player else cache_path
+        os.makedirs(self.cache_path, exist_ok=True)
+        self.cut_off = section.getint('cut_off', fallback=cut_off)
+        self.workers = workers
+        self.name = section.get('name') or player or 'Someone'
+        self.recipients = [jid.strip() for jid in section.get('recipients', '').split(',') if jid.strip()]
+        self.booking_sender = section.get('booking_sender') or config.get('Gmail', 'booking_sender', fallback=None)
+        self.booking_subject = section.get('booking_subject') or config.get('Gmail', 'booking_subject', fallback=None)
+        # Sunday league match dates (relative to config_path). Each player has their own file, if any.
+        dates_file = section.get('dates_file', fallback=None if player else 'soccer.txt')
+        self.dates_file = os.path.join(config_path, dates_file) if dates_file else None
+
+        gmail_refresh_token = os.path.join(self.cache_path, 'gmail_refresh_token')
+        if not os.path.isfile(gmail_refresh_token):
+            Path(gmail_refresh_token).touch()
+
+        # Setup Google OAUTH instance for acccessing Gmail.
+        gmail_scopes = [
+            'https://www.googleapis.com/auth/gmail.readonly',
+            'https://www.googleapis.com/auth/userinfo.email',
+        ]
+        self.oauth = GoogleAuth(config.get('Gmail', 'client_id'), config.get('Gmail', 'client_secret'),
+                                gmail_scopes, gmail_refresh_token)
+        self.oauth.authenticate()
+        logging.debug('Getting emails for: %s.', self.oauth.get_email())
+
+        # Shared session so that connections are pooled across all Gmail requests.
+        # In team mode the connection pool (adapter) is also shared between players.
+        self.session = requests.Session()
+        if adapter is not None:
+            self.session.mount('https://', adapter)
+
+    def check(self, last_date=None):
+        """Check for events within the cut-off. Returns shaming message if there weren't any, otherwise None."""
+        # Access token expires after an hour, so refresh it if needed.
+        self.oauth.authenticate()
+        self.session.headers['Authorization'] = f'OAuth {self.oauth.access_token}'
+
+        # Retrieves messages received in the past x days that weren't seen on previous runs.
+        current_date = dt.datetime.today()
+        after_date = (current_date - dt.timedelta(days=self.cut_off)).date()
+        sync_state = sync_messages(self.session, load_sync_state(self.cache_path), after_date, workers=self.workers,
+                                   sender=self.booking_sender, subject=self.booking_subject)
+        write_sync_state(self.cache_path, sync_state)
+
+        # Event dates from all sources are kept in one store.
+        # Includes Sunday league match dates, since won't have futsal those days.
+        events = EventStore(os.path.join(self.cache_path, 'events.sqlite3'))
+        if self.dates_file:
+            events.import_dates_file(self.dates_file, 'league')
+        events.import_dates_file(os.path.join(self.cache_path, 'last_date'), 'manual')  # Saved by older versions.
+        if last_date:
+            events.add(dt.datetime.strptime(last_date, '%Y%m%d').date(), 'manual')
+        for message_id, record in sync_state['messages'].items():
+            events.add_many((dt.datetime.strptime(date_str, '%Y%m%d').date() for date_str in record['events']),
+                            'email', message_id)
+
+        had_event_this_week = events.has_event_between(after_date)
+        last_event = events.latest_before(after_date)
+        events.close()
+
+        if had_event_this_week:
+            logging.info('%s went to event in the past week - no need to send shaming message!', self.name)
+            return None
+        last_event_str = last_event.strftime('%Y/%m/%d') if last_event else 'never'
+        return f'{self.name} has been naughty. Last attended futsal or soccer was on {last_event_str}.'
+
+    def close(self):
+        self.session.close()
+
+
+def run_checks(shamers, chat, parallel=4, last_date=None, keep_alive=False):
+    """Run checks for all shamers concurrently, then send all shaming messages over the one Hangouts session.
+    A check that fails (eg. expired refresh token) doesn't stop the other players' messages from being sent.
+    Returns list of (Shamer, message or None, exception or None) tuples.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = [(shamer, executor.submit(shamer.check, last_date)) for shamer in shamers]
+        for shamer, future in futures:
+            try:
+                results.append((shamer, future.result(), None))
+            except Exception as e:  # pylint: disable=broad-except
+                logging.exception('Check failed for %s.', shamer.name)
+                results.append((shamer, None, e))
+
+    for shamer, message, error in results:
+        logging.info('%s: %s', shamer.name, check_status(message, error))
+        if message:
+            chat.send(message, shamer.recipients)
+    if not keep_alive:
+        chat.disconnect()
+    return results
+
+
+def check_status(message, error):
+    if error is not None:
+        return f'ERROR ({error})'
+    return message or 'OK'
+
+
+def run_daemon(run_check, schedule):
+    """Call run_check forever according to the given CronSchedule."""
+    while True:
+        next_run = schedule.next_run(dt.datetime.now())
+        logging.info('Next check at %s.', next_run.strftime('%Y/%m/%d %H:%M'))
+        sleep(max((next_run - dt.datetime.now()).total_seconds(), 0))
+        try:
+            run_check()
+        except Exception:  # pylint: disable=broad-except
+            # Don't let a single failed check (eg. network down) kill the daemon.
+            logging.exception('Check failed.')
+
+
 @click.command()
 @click.option(
     '--config-path',
@@ -107,7 +492,27 @@ def create_dir(ctx, param, directory):
     '--last-date',
     type=click.STRING,
     callback=validate_date, expose_value=True,
-    help='Date of last event.',
+    help='Date of last event. Not allowed with --team, use dates_file in each player\'s section instead.',
+)
+@click.option(
+    '--workers',
+    default=8,
+    help='Number of Gmail messages to fetch concurrently.',
+)
+@click.option(
+    '--team',
+    is_flag=True,
+    help='Check every player listed in [Team] players, each using their own config section.',
+)
+@click.option(
+    '--parallel',
+    default=4,
+    help='Number of players to check concurrently in team mode.',
+)
+@click.option(
+    '--daemon',
+    is_flag=True,
+    help='Keep running and check on the schedule set in the config file ([Schedule] cron).',
 )
 @click.option(
     '--log-level',
@@ -116,13 +521,16 @@ def create_dir(ctx, param, directory):
     default='debug',
     help='Set log level.',
 )
-def main(config_path, cache_path, cut_off, last_date, log_level):
+def main(config_path, cache_path, cut_off, last_date, workers, team, parallel, daemon, log_level):
     """Check Gmail for futsal confirmation emails and send 'shame' message on Hangouts if haven't been in the past week.
 
     NOTE:
     OAuth for devices doesn't support Hangouts or Gmail scopes, so have to send auth link through the terminal.
     https://developers.google.com/identity/protocols/OAuth2ForDevices
     """
+    if team and last_date:
+        # It would be saved as an event for every player.
+        raise click.UsageError('--last-date can only be used for a single player.')
     configure_logging(cache_path, log_level)
 
     # TODO: config from env vars
@@ -131,98 +539,31 @@ def main(config_path, cache_path, cut_off, last_date, log_level):
     logging.debug('Using config file: %s.', config_file)
     config = ConfigParser()
     config.read(config_file)
-    gmail_client_id = config.get('Gmail', 'client_id')
-    gmail_client_secret = config.get('Gmail', 'client_secret')
-    gmail_refresh_token = os.path.join(cache_path, 'gmail_refresh_token')
-    if not os.path.isfile(gmail_refresh_token):
-        Path(gmail_refresh_token).touch()
-    hangouts_client_id = config.get('Hangouts', 'client_id')
-    hangouts_client_secret = config.get('Hangouts', 'client_secret')
-    hangouts_refresh_token = os.path.join(cache_path, 'hangouts_refresh_token')
-    if not os.path.isfile(hangouts_refresh_token):
-        Path(hangouts_refresh_token).touch()
-
-    # Setup Google OAUTH instance for acccessing Gmail.
-    gmail_scopes = [
-        'https://www.googleapis.com/auth/gmail.readonly',
-        'https://www.googleapis.com/auth/userinfo.email',
-    ]
-    oauth = GoogleAuth(gmail_client_id, gmail_client_secret, gmail_scopes, gmail_refresh_token)
-    oauth.authenticate()
-
-    # Retrieves all messages received in the past x days:
-    logging.debug('Getting emails for: %s.', oauth.get_email())
-    current_date = dt.datetime.today()
-    after = (current_date - dt.timedelta(days=cut_off)).strftime('%Y/%m/%d')
-    url = f'https://www.googleapis.com/gmail/v1/users/me/messages?q="after:{after}"'
-    authorization_header = {'Authorization': 'OAuth {oauth.access_token}'}
-    resp = requests.get(url, headers=authorization_header)
-    data = resp.json()
-
-    # Extract futsal event dates from email message body to check date of last event.
-    # Initialise with Sunday league match dates, since won't have futsal those days.
-    event_dates = list(get_soccer_dates(config_path))
-    had_event_this_week = 0
-    if 'messages' in data:
-        for message in data['messages']:
-            url = f'https://www.googleapis.com/gmail/v1/users/me/messages/{message["id"]}?format=raw'
-            authorization_header = {f'Authorization': 'OAuth {oauth.access_token}'}
-            resp = requests.get(url, headers=authorization_header)  # Raw email data.
-
-            if resp.status_code == 200:
-                data = json.loads(resp.text)  # requests' json() method seems to have issues handling this response.
-                email_dt = dt.datetime.fromtimestamp(int(data['internalDate'])/1000)  # Google gives epoch in μs.
-                decoded_raw_text = base64.urlsafe_b64decode(data['raw'])
-                parsed_raw_text = email.message_from_bytes(decoded_raw_text)
-
-                for part in parsed_raw_text.walk():
-                    decoded_message = part.get_payload(decode=True)
-                    if decoded_message:
-                        # Strip html tags (see http://stackoverflow.com/a/4869782).
-                        cleaned_message = re.sub('<[^<]+?>', '', decoded_message.decode('utf-8'))
-                        # Get futsal event date part of string.
-                        date_prefixes = ['第１希望：', '日程：']
-                        for prefix in date_prefixes:
-                            try:
-                                date_str = cleaned_message.split(prefix, 1)[1][:5]
-                                # Confirmation email doesn't include the year, so assume the year from email timestamp.
-                                futsal_date = dt.datetime.strptime(date_str, '%m/%d').replace(year=email_dt.year).date()
-                                event_dates.append(futsal_date)
-                            except IndexError:
-                                pass
-
-                # TODO: clean up code below, handle case of multiple dates from the same week
-                for date in event_dates:
-                    if date < (current_date - dt.timedelta(days=cut_off)).date():
-                        had_event_this_week = -1
-    else:
-        logging.info('No mails found from the past week.')
-        had_event_this_week = -1
-
-    last_event_str = last_date or get_last_date(cache_path)
-    last_event = dt.datetime.strptime(last_event_str, '%Y%m%d').date()
-    if max(event_dates) > last_event:
-        last_event = max(event_dates)
-
-    write_last_date(cache_path, last_event.strftime('%Y%m%d'))
-
-    if last_event >= (current_date - dt.timedelta(days=cut_off)).date():
-        had_event_this_week = 0
 
-    if had_event_this_week == -1:
-        message = f'Someone has been naughty. Last attended futsal or soccer was on {last_event.strftime("%Y/%m/%d")}.'
-
-        hangouts = HangoutsClient(hangouts_client_id, hangouts_client_secret, hangouts_refresh_token)
-        if hangouts.connect():
-            hangouts.process(block=False)
-            sleep(5)  # Need time for Hangouts roster to update.
-            hangouts.send_to_all(message)
-            hangouts.disconnect(wait=True)
-            logging.info('Finished sending message.')
-        else:
-            logging.error('Unable to connect to Hangouts.')
+    chat = HangoutsSession(config, cache_path)
+    if team:
+        players = [player.strip() for player in config.get('Team', 'players').split(',') if player.strip()]
+        # One connection pool shared by all players.
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=parallel * workers)
+        # Authenticate one at a time, since new players may need to enter an auth code in the terminal.
+        shamers = [Shamer(config, config_path, cache_path, cut_off, workers, player, adapter) for player in players]
     else:
-        logging.info('Went to event in the past week - no need to send shaming message!')
+        shamers = [Shamer(config, config_path, cache_path, cut_off, workers)]
+
+    try:
+        results = run_checks(shamers, chat, parallel, last_date, keep_alive=daemon)
+        if team:
+            for shamer, message, error in results:
+                click.echo(f'{shamer.name}: {check_status(message, error)}')
+        if not daemon and any(error is not None for _, _, error in results):
+            raise SystemExit(1)
+        if daemon:
+            schedule = CronSchedule(config.get('Schedule', 'cron', fallback='0 21 * * *'))
+            run_daemon(lambda: run_checks(shamers, chat, parallel, keep_alive=True), schedule)
+    finally:
+        chat.disconnect()
+        for shamer in shamers:
+            shamer.close()
 
 
 def configure_logging(log_dir, log_level):
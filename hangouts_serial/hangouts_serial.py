@@ -6,11 +6,14 @@
 import logging
 import os.path
 from argparse import ArgumentParser
+from configparser import ConfigParser
 from queue import Queue  # pylint: disable=C0411
 from sys import path
 
 # Ammcon imports
+import h_bytecmds as PCMD
 from hangoutsclient import HangoutsClient
+from sensorpoller import SensorPoller
 from serialmanager import SerialManager
 
 __title__ = 'hangouts_serial'
@@ -67,10 +70,15 @@ def main(arguments):
                                 command_queue, response_queue)
     serial_port.start()
 
+    # Setup and start sensor poller thread (disable by leaving sensors blank)
+    poller = create_poller(args.config_path, command_queue)
+    if poller is not None:
+        poller.start()
+
     if args.enable_hangouts:
         # Setup Hangouts client instance
         server = HangoutsClient(args.config_path,
-                                command_queue, response_queue)
+                                command_queue, response_queue, poller)
 
         # Connect to Hangouts and start processing XMPP stanzas.
         if server.connect(address=('talk.google.com', 5222),
@@ -78,7 +86,7 @@ def main(arguments):
                           use_tls=True):
             if args.standalone:
                 server.process(block=True)
-                # Allow temp logger thread to exit gracefully by sending stop signal.
+                # Allow sensor poller thread to exit gracefully by sending stop signal.
                 server.stop_threads = 1
                 logging.info('Ended Hangouts server instance')
             else:
@@ -86,6 +94,24 @@ def main(arguments):
         else:
             logging.error('Unable to connect to Hangouts.')
 
+
+def create_poller(config_path, command_queue):
+    '''Create sensor poller from [Poller] section of config file, or None if no sensors are set.'''
+    config = ConfigParser()
+    config.read(config_path)
+    sensors = config.get('Poller', 'sensors', fallback='temp')
+    sensors = [sensor.strip() for sensor in sensors.split(',') if sensor.strip()]
+    if not sensors:
+        return None
+    return SensorPoller({sensor: PCMD.micro_commands[sensor] for sensor in sensors},
+                        command_queue,
+                        config.get('Poller', 'database', fallback=os.path.join(cwd, 'readings.sqlite3')),
+                        fast_interval=config.getfloat('Poller', 'fast_interval', fallback=15),
+                        slow_interval=config.getfloat('Poller', 'slow_interval', fallback=300),
+                        active_period=config.getfloat('Poller', 'active_period', fallback=600),
+                        batch=config.getboolean('Poller', 'batch_reads', fallback=False))
+
+
 if __name__ == '__main__':
     from sys import argv  # pylint: disable=C0412
     main(argv[1:])
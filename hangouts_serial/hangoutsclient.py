@@ -32,7 +32,7 @@ class HangoutsClient(ClientXMPP):
     # pylint: disable=too-many-instance-attributes
     # 11 instance variables seems OK to me in this case
 
-    def __init__(self, config_path, command_queue, response_queue):
+    def __init__(self, config_path, command_queue, response_queue, poller=None):
         # Read in config values
         self.config = ConfigParser()
         self.config.read(config_path)
@@ -105,6 +105,21 @@ class HangoutsClient(ClientXMPP):
         self.command_queue = command_queue
         self.response_queue = response_queue
 
+        # Background sensor poller (optional). Sensor commands are answered
+        # from its latest sample instead of going through the serial port.
+        self.poller = poller
+
+    @property
+    def stop_threads(self):
+        ''' True once background threads have been told to stop. '''
+        return self.poller is not None and self.poller.stopped.is_set()
+
+    @stop_threads.setter
+    def stop_threads(self, value):
+        ''' Set to stop background threads (the sensor poller). '''
+        if value and self.poller is not None:
+            self.poller.stop()
+
     def reconnect_workaround(self, event):  # pylint: disable=W0613
         ''' Workaround for SleekXMPP reconnect.
         If a reconnect is attempted after access token is expired,
@@ -182,7 +197,15 @@ class HangoutsClient(ClientXMPP):
 
             if self.amm_hangouts_id in hangouts_user:
                 logging.debug('[Hangouts] ammID verified (%s)', hangouts_user)
-                if command in PCMD.micro_commands:
+                sample = None
+                if self.poller is not None:
+                    # Poll faster while user is around (commands may change sensor readings too)
+                    self.poller.notify_activity()
+                    sample = self.poller.latest_value(command)
+                if sample is not None:
+                    logging.debug('[Hangouts] Command "%s" answered from latest sensor sample.', command)
+                    response = sample
+                elif command in PCMD.micro_commands:
                     logging.debug('[Hangouts] Command "%s" received. '
                                   'Sending to command queue for processing...', command)
                     self.command_queue.put(PCMD.micro_commands[command])
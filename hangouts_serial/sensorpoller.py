@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Python Standard Library imports
+import logging
+import sqlite3
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import monotonic, time
+
+
+class ReadingStore(object):
+    '''SQLite store of sensor samples. Values are the raw response frames
+    from the microcontroller, same as what is sent back to Hangouts.'''
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS readings (
+                sensor TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                value BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS readings_sensor_timestamp ON readings (sensor, timestamp);
+        ''')
+
+    def add_many(self, samples):
+        '''Add list of (sensor, timestamp, value) tuples in one transaction.'''
+        with self.db:
+            self.db.executemany('INSERT INTO readings (sensor, timestamp, value) VALUES (?, ?, ?)', samples)
+
+    def since(self, sensor, timestamp):
+        '''Get list of (timestamp, value) for sensor since the given unix time, oldest first.'''
+        return self.db.execute('SELECT timestamp, value FROM readings WHERE sensor = ? AND timestamp >= ? '
+                               'ORDER BY timestamp', (sensor, timestamp)).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+class SensorPoller(Thread):
+    '''Background thread that samples the microcontroller's sensors and saves
+    the readings, so that sensor commands can be answered without waiting on
+    the serial port.
+
+    Poll interval adapts to what is going on: it drops to fast_interval
+    whenever a reading changes or a user has been active in the last
+    active_period seconds, and otherwise doubles after each poll up to
+    slow_interval.
+
+    If the firmware accepts several commands in one write (replying with one
+    frame per command, in order) set batch=True to read all sensors in a
+    single serial transaction.
+
+    Commands go through the SerialManager command queue with a response queue
+    of the poller's own, so its responses can't get mixed up with replies to
+    interactive commands.
+    '''
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, sensors, command_queue, db_path, fast_interval=15, slow_interval=300,
+                 active_period=600, batch=False, timeout=10):
+        Thread.__init__(self)
+        self.daemon = True
+
+        # Dict of sensor name (same as the Hangouts command, eg. 'temp') -> command bytes
+        self.sensors = sensors
+        self.command_queue = command_queue
+        self.response_queue = Queue()
+        self.db_path = db_path
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.active_period = active_period
+        self.batch = batch
+        self.timeout = timeout
+
+        # Latest (timestamp, value) of each sensor
+        self.latest = {}
+        self.latest_lock = Lock()
+        self.last_activity = None
+        self.wakeup = Event()
+        self.stopped = Event()
+
+    def run(self):
+        # sqlite connections can only be used from the thread that created them
+        store = ReadingStore(self.db_path)
+        interval = self.fast_interval
+        try:
+            while not self.stopped.is_set():
+                changed = self.poll(store)
+                if changed or self.user_active():
+                    interval = self.fast_interval
+                else:
+                    interval = min(interval * 2, self.slow_interval)
+                logging.debug('[Poller] Next poll in %s seconds', interval)
+                self.wakeup.wait(interval)
+                self.wakeup.clear()
+        finally:
+            store.close()
+
+    def poll(self, store):
+        '''Read all sensors and save the readings. Returns True if any reading changed.'''
+        # Throw away any late response to a previous poll that timed out
+        while not self.response_queue.empty():
+            self.response_queue.get_nowait()
+
+        names = list(self.sensors)
+        try:
+            if self.batch:
+                command = b''.join(self.sensors[name] for name in names)
+                self.command_queue.put((command, self.response_queue, len(names)))
+                values = self.response_queue.get(timeout=self.timeout)
+                if len(names) == 1:
+                    # SerialManager sends a single frame back on its own, not in a list
+                    values = [values]
+            else:
+                values = []
+                for name in names:
+                    self.command_queue.put((self.sensors[name], self.response_queue, 1))
+                    values.append(self.response_queue.get(timeout=self.timeout))
+        except Empty:
+            logging.warning('[Poller] No response from microcontroller within %s seconds', self.timeout)
+            return False
+
+        timestamp = time()
+        store.add_many([(name, timestamp, value) for name, value in zip(names, values)])
+        changed = False
+        with self.latest_lock:
+            for name, value in zip(names, values):
+                previous = self.latest.get(name)
+                changed = changed or previous is None or previous[1] != value
+                self.latest[name] = (timestamp, value)
+        logging.debug('[Poller] Sampled %s sensor(s), changed: %s', len(names), changed)
+        return changed
+
+    def user_active(self):
+        return self.last_activity is not None and monotonic() - self.last_activity < self.active_period
+
+    def notify_activity(self):
+        '''Call when a user sends a command. Switches to fast polling and takes a sample straight away.'''
+        self.last_activity = monotonic()
+        self.wakeup.set()
+
+    def latest_value(self, sensor, max_age=None):
+        '''Get latest reading of sensor, or None if there isn't one from the last max_age seconds
+        (default slow_interval plus the response timeout).'''
+        if max_age is None:
+            max_age = self.slow_interval + self.timeout
+        with self.latest_lock:
+            sample = self.latest.get(sensor)
+        if sample is None or time() - sample[0] > max_age:
+            return None
+        return sample[1]
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
@@ -13,7 +13,7 @@ class SerialManager(Thread):
     from the serial port, it can be shared between multiple Python threads, or
     processes if changed to use multiprocessing module instead.'''
 
-    def __init__(self, port, command_queue, response_queue, blocking=False, eolchar=b'xFF'):
+    def __init__(self, port, command_queue, response_queue, blocking=False, eolchar=b'\xFF'):
         Thread.__init__(self)
         if not blocking:
             self.daemon = True  # Thread class default is False
@@ -50,6 +50,14 @@ class SerialManager(Thread):
         for command in iter(self.command_queue.get, None):
             logging.debug('Received command in queue: %s', command)
 
+            # Commands can also be sent as (command, response queue, number of
+            # response frames) so that eg. the sensor poller gets its responses
+            # on its own queue, and can batch several commands in one write.
+            # Responses with more than one frame are sent back as a list.
+            response_queue, frames = self.response_queue, 1
+            if isinstance(command, tuple):
+                command, response_queue, frames = command
+
             # Send command to microcontroller
             self.send_command(command)
 
@@ -57,10 +65,13 @@ class SerialManager(Thread):
 
             # Read in response from microcontroller
             # response = self.get_response()  # unreliable
-            response = self.get_response_until()  # may block forever
+            if frames == 1:
+                response = self.get_response_until()  # may block forever
+            else:
+                response = [self.get_response_until() for _ in range(frames)]
 
             #  Send response back to client
-            self.response_queue.put(response)
+            response_queue.put(response)
             # Tell queue that the job is done
             self.command_queue.task_done()
 
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+Run any of the scripts in this repo under a profiler without editing it.
+
+    python profiling.py [--mode cprofile|sample|tracemalloc] [--top N] [--output-dir DIR] path/to/script.py [args...]
+
+The script is run as __main__ with its own directory first on sys.path, same as running it directly,
+so this works for every entry point (hangouts_serial, shamer, aquos_cmd, farcasoup, batbaby, send_wol...).
+Works with both python 2 and 3 (tracemalloc mode needs python 3).
+
+Modes:
+    cprofile     deterministic profile of every function call, in every thread (default).
+                 times from threads running at once add up, so for where a run spends wall time
+                 with thread pools (shamer, batbaby, farcasoup) sample mode is clearer
+    sample       samples the stacks of all threads every few ms, lower overhead for long runs
+    tracemalloc  snapshot of memory allocated by the end of the run, plus peak usage
+
+Defaults can also be set with environment variables, eg. for scripts run from cron:
+    PROFILE_MODE, PROFILE_TOP, PROFILE_DIR, PROFILE_INTERVAL
+
+Each run writes its reports to PROFILE_DIR (default ~/.cache/juanoffcodes/profiles) as
+<script>_<YYYYmmdd_HHMMSS>_<pid>.* with a top-N summary in the .txt file.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import datetime as dt
+import os
+import runpy
+import sys
+import threading
+import time
+
+DEFAULT_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                           'juanoffcodes', 'profiles')
+
+
+def run_script(path, args):
+    """
+    run script as __main__ with the given command line args
+    """
+    sys.argv = [path] + list(args)
+    sys.path[0] = os.path.dirname(os.path.abspath(path))
+    runpy.run_path(path, run_name='__main__')
+
+
+def profile_cprofile(path, args, report_base, top):
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    thread_profilers = []
+    if sys.version_info < (3, 12):
+        # before 3.12 a profiler only sees the thread that enabled it, so give each new thread
+        # (eg. thread pool workers) its own profiler and merge them at the end.
+        # from 3.12 cProfile uses sys.monitoring and already sees every thread.
+        def start_thread_profiler(frame, event, arg):
+            sys.setprofile(None)
+            thread_profiler = cProfile.Profile()
+            thread_profilers.append(thread_profiler)
+            thread_profiler.enable()
+        threading.setprofile(start_thread_profiler)
+
+    profiler.enable()
+    try:
+        run_script(path, args)
+    finally:
+        profiler.disable()
+        threading.setprofile(None)
+        with open(report_base + '.txt', 'w') as f:
+            stats = pstats.Stats(profiler, stream=f)
+            for thread_profiler in thread_profilers:
+                stats.add(thread_profiler)
+            stats.dump_stats(report_base + '.prof')
+            stats.sort_stats('cumulative').print_stats(top)
+            stats.sort_stats('tottime').print_stats(top)
+
+
+class StackSampler(threading.Thread):
+    """
+    background thread that records the stack of every other thread at a fixed interval
+    """
+
+    def __init__(self, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.samples = 0
+        self.self_counts = collections.Counter()
+        self.total_counts = collections.Counter()
+
+    def run(self):
+        own_id = threading.current_thread().ident
+        while not self.stopped.is_set():
+            for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if thread_id == own_id:
+                    continue
+                self.samples += 1
+                self.self_counts[self.frame_name(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    name = self.frame_name(frame)
+                    # only count recursive functions once per sample
+                    if name not in seen:
+                        self.total_counts[name] += 1
+                        seen.add(name)
+                    frame = frame.f_back
+            time.sleep(self.interval)
+
+    @staticmethod
+    def frame_name(frame):
+        code = frame.f_code
+        return '%s:%d(%s)' % (code.co_filename, code.co_firstlineno, code.co_name)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write_report(self, path, top):
+        with open(path, 'w') as f:
+            f.write('%d samples every %.1f ms\n' % (self.samples, self.interval * 1000))
+            for title, counts in (('self', self.self_counts), ('inclusive', self.total_counts)):
+                f.write('\nTop %d functions by %s samples:\n' % (top, title))
+                for name, count in counts.most_common(top):
+                    f.write('%8d %6.1f%%  %s\n' % (count, 100.0 * count / max(self.samples, 1), name))
+
+
+def profile_sample(path, args, report_base, top, interval):
+    sampler = StackSampler(interval)
+    sampler.start()
+    try:
+        run_script(path, args)
+    finally:
+        sampler.stop()
+        sampler.write_report(report_base + '.txt', top)
+
+
+def profile_tracemalloc(path, args, report_base, top):
+    try:
+        import tracemalloc
+    except ImportError:
+        sys.exit('tracemalloc mode needs python 3')
+
+    tracemalloc.start(25)
+    try:
+        run_script(path, args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot.dump(report_base + '.tracemalloc')
+        with open(report_base + '.txt', 'w') as f:
+            f.write('current %.1f KiB, peak %.1f KiB\n' % (current / 1024.0, peak / 1024.0))
+            f.write('\nTop %d allocation sites:\n' % top)
+            for stat in snapshot.statistics('lineno')[:top]:
+                f.write('%s\n' % stat)
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description='Run a script under a profiler.')
+    parser.add_argument('-m', '--mode',
+                        choices=['cprofile', 'sample', 'tracemalloc'],
+                        default=os.environ.get('PROFILE_MODE', 'cprofile'),
+                        help='profiler to use (default: %(default)s)')
+    parser.add_argument('-n', '--top',
+                        type=int, default=int(os.environ.get('PROFILE_TOP', 30)),
+                        help='number of entries in summary (default: %(default)s)')
+    parser.add_argument('-o', '--output-dir',
+                        default=os.environ.get('PROFILE_DIR', DEFAULT_DIR),
+                        help='directory to write reports to (default: %(default)s)')
+    parser.add_argument('-i', '--interval',
+                        type=float, default=float(os.environ.get('PROFILE_INTERVAL', 0.005)),
+                        help='seconds between samples in sample mode (default: %(default)s)')
+    parser.add_argument('script', help='script to run')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments for the script')
+    args = parser.parse_args(arguments)
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    run_id = '%s_%s_%d' % (os.path.splitext(os.path.basename(args.script))[0],
+                           dt.datetime.now().strftime('%Y%m%d_%H%M%S'), os.getpid())
+    report_base = os.path.join(args.output_dir, run_id)
+
+    try:
+        if args.mode == 'cprofile':
+            profile_cprofile(args.script, args.args, report_base, args.top)
+        elif args.mode == 'sample':
+            profile_sample(args.script, args.args, report_base, args.top, args.interval)
+        else:
+            profile_tracemalloc(args.script, args.args, report_base, args.top)
+    finally:
+        print('Profile (%s) written to %s.*' % (args.mode, report_base), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
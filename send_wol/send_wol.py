@@ -2,22 +2,66 @@
 """
 Send a WOL magic packet. Works on both Linux and Windows.
 
+Bulk mode reads hosts from an inventory file (CSV or JSON) or MAC addresses
+from stdin, builds all the magic packets up front and sends them from a single
+broadcast socket, paced so as not to flood the network (or wake every machine
+at the exact same moment and spike the power draw).
+
+With --confirm, every target that has a host address (mac=host on the command
+line) is then probed concurrently (TCP connect or UDP echo) until it responds,
+resending the magic packet with backoff to hosts that stay down, and the
+time-to-wake is reported.
+
+Inventory CSV has one host per line: mac[,broadcast_address[,port[,host]]]
+Inventory JSON is a list of objects: {"mac": ..., "broadcast": ..., "port": ..., "host": ...}
+
 @author: ammgws
 """
+import asyncio
+import csv
+import json
+import sys
+from argparse import ArgumentParser
+from collections import namedtuple
 from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST
+from time import monotonic, sleep
+
+DEFAULT_BROADCAST = '255.255.255.255'
+DEFAULT_PORT = 9
 
+# host is the address to probe when confirming the machine has woken up
+Target = namedtuple('Target', ['mac', 'broadcast', 'port', 'host'], defaults=(None,))
 
-def send_magic_packet(mac_address, broadcast_address, port=9):
-    """ Send a WOL magic packet for the specified MAC address"""
-    # Create an IPv4, UDP socket
+
+def build_magic_packet(mac_address):
+    """ Build WOL magic packet (FF repeated 6 times followed by MAC repeated 16 times)"""
+    mac_bytes = bytes.fromhex(mac_address.replace(':', '').replace('-', ''))
+    if len(mac_bytes) != 6:
+        raise ValueError(f'Invalid MAC address: {mac_address}')
+    return b'\xFF' * 6 + mac_bytes * 16
+
+
+def create_broadcast_socket():
+    """ Create an IPv4, UDP socket that can send datagrams to broadcast addresses"""
     sock = socket(family=AF_INET, type=SOCK_DGRAM)
-    # Enable sending datagrams to broadcast addresses
     sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-    # Build magic packet
-    mac_address = bytes.fromhex(mac_address.replace(':', ''))
-    magic_packet = b'\xFF' * 6 + mac_address * 16
+    return sock
+
+
+def send_magic_packet(mac_address, broadcast_address, port=9, sock=None):
+    """ Send a WOL magic packet for the specified MAC address.
+    Pass in an existing socket to avoid creating a new one for every packet.
+    """
+    own_socket = sock is None
+    if own_socket:
+        sock = create_broadcast_socket()
+    magic_packet = build_magic_packet(mac_address)
     # Send magic packet
-    result = sock.sendto(magic_packet, (broadcast_address, port))
+    try:
+        result = sock.sendto(magic_packet, (broadcast_address, port))
+    finally:
+        if own_socket:
+            sock.close()
     # Success: sent all 102 bytes of the magic packet
     if result == len(magic_packet):
         ack = 'ACK'
@@ -27,9 +71,205 @@ def send_magic_packet(mac_address, broadcast_address, port=9):
     return ack
 
 
-def main():
-    result = send_magic_packet('xx:xx:xx:xx:xx:xx', 'xx.xx.xx.xx')
-    print(result)
+def read_inventory(path, broadcast_address=DEFAULT_BROADCAST, port=DEFAULT_PORT):
+    """ Generator that yields a Target for each host in a CSV or JSON inventory file.
+    Missing broadcast address/port fields fall back to the given defaults.
+    """
+    with open(path, newline='') as f:
+        if path.lower().endswith('.json'):
+            for host in json.load(f):
+                yield Target(host['mac'],
+                             host.get('broadcast') or broadcast_address,
+                             int(host.get('port') or port),
+                             host.get('host'))
+        else:
+            for row in csv.reader(f):
+                # Skip blank lines and comments
+                if not row or row[0].strip().startswith('#'):
+                    continue
+                fields = [field.strip() for field in row] + ['', '', '']
+                yield Target(fields[0], fields[1] or broadcast_address, int(fields[2] or port), fields[3] or None)
+
+
+def read_macs(stream, broadcast_address=DEFAULT_BROADCAST, port=DEFAULT_PORT):
+    """ Generator that yields a Target for each MAC address (one per line) in stream.
+    A line may optionally give the host address to probe after the MAC, separated by whitespace.
+    """
+    for line in stream:
+        fields = line.split()
+        if fields and not fields[0].startswith('#'):
+            yield Target(fields[0], broadcast_address, port, fields[1] if len(fields) > 1 else None)
+
+
+def send_magic_packets(targets, rate=100.0, burst=10):
+    """ Send magic packets to many targets from one socket.
+    Packets go out in bursts of `burst` packets, with bursts spaced so that the
+    average send rate does not exceed `rate` packets per second.
+    Returns list of (Target, 'ACK'/'NAK') tuples in the same order as targets.
+    """
+    # Prebuild all packets so that a bad MAC fails before anything is sent.
+    packets = [(target, build_magic_packet(target.mac)) for target in targets]
+    burst = max(1, burst)
+    interval = burst / rate if rate > 0 else 0
+
+    results = []
+    sock = create_broadcast_socket()
+    try:
+        next_burst = monotonic()
+        for index, (target, packet) in enumerate(packets):
+            if index and index % burst == 0 and interval:
+                next_burst += interval
+                delay = next_burst - monotonic()
+                if delay > 0:
+                    sleep(delay)
+            sent = sock.sendto(packet, (target.broadcast, target.port))
+            results.append((target, 'ACK' if sent == len(packet) else 'NAK'))
+    finally:
+        sock.close()
+    return results
+
+
+async def probe_tcp(host, port, timeout):
+    """ Return True if a TCP connection to host:port can be opened within timeout."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+class _EchoProtocol(asyncio.DatagramProtocol):
+    def __init__(self, reply):
+        self.reply = reply
+
+    def datagram_received(self, data, addr):
+        if not self.reply.done():
+            self.reply.set_result(True)
+
+    def error_received(self, exc):
+        # eg. ICMP port unreachable; host is up but treat as not (yet) ready
+        pass
+
+
+async def probe_udp(host, port, timeout):
+    """ Return True if host:port answers a UDP echo request within timeout."""
+    loop = asyncio.get_running_loop()
+    reply = loop.create_future()
+    try:
+        transport, _ = await loop.create_datagram_endpoint(lambda: _EchoProtocol(reply),
+                                                           remote_addr=(host, port))
+    except OSError:
+        return False
+    try:
+        transport.sendto(b'ping')
+        return await asyncio.wait_for(reply, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        transport.close()
+
+
+async def confirm_wake(target, sock, probe=probe_tcp, probe_port=22, timeout=120.0,
+                       interval=1.0, resend_after=10.0, backoff=2.0):
+    """ Probe target until it responds, resending the magic packet with backoff while it stays down.
+    Returns seconds taken for the host to respond, or None if it didn't respond within timeout.
+    """
+    start = monotonic()
+    deadline = start + timeout
+    next_resend = start + resend_after
+    while monotonic() < deadline:
+        if await probe(target.host, probe_port, min(interval, max(deadline - monotonic(), 0.1))):
+            return monotonic() - start
+        now = monotonic()
+        if now >= next_resend:
+            send_magic_packet(target.mac, target.broadcast, target.port, sock=sock)
+            resend_after *= backoff
+            next_resend = now + resend_after
+        # Don't sleep past the deadline
+        await asyncio.sleep(min(interval, max(deadline - monotonic(), 0)))
+    return None
+
+
+async def confirm_targets(targets, probe='tcp', probe_port=22, timeout=120.0, resend_after=10.0):
+    """ Concurrently confirm that all targets with a host address have woken up.
+    Returns list of (Target, seconds to wake or None) tuples in the same order as targets.
+    """
+    probe = probe_udp if probe == 'udp' else probe_tcp
+    targets = [target for target in targets if target.host]
+    sock = create_broadcast_socket()
+    try:
+        times = await asyncio.gather(*(confirm_wake(target, sock, probe, probe_port, timeout,
+                                                    resend_after=resend_after)
+                                       for target in targets))
+    finally:
+        sock.close()
+    return list(zip(targets, times))
+
+
+def main(arguments):
+    parser = ArgumentParser(description='Send WOL magic packet(s).')
+    parser.add_argument('mac', nargs='*',
+                        help='MAC address(es) to wake, in the form xx:xx:xx:xx:xx:xx '
+                             '(or xx:xx:xx:xx:xx:xx=host to give the address to probe with --confirm)')
+    parser.add_argument('-i', '--inventory',
+                        help='CSV or JSON file of hosts to wake')
+    parser.add_argument('--stdin',
+                        action='store_true',
+                        help='read MAC addresses from stdin, one per line')
+    parser.add_argument('-b', '--broadcast',
+                        default=DEFAULT_BROADCAST,
+                        help='default broadcast address (default: %(default)s)')
+    parser.add_argument('-p', '--port',
+                        type=int, default=DEFAULT_PORT,
+                        help='default UDP port (default: %(default)s)')
+    parser.add_argument('-r', '--rate',
+                        type=float, default=100.0,
+                        help='max packets per second in bulk mode, 0 for unlimited (default: %(default)s)')
+    parser.add_argument('--burst',
+                        type=int, default=10,
+                        help='packets sent back-to-back before pausing (default: %(default)s)')
+    parser.add_argument('-c', '--confirm',
+                        action='store_true',
+                        help='probe hosts until they respond and report time-to-wake')
+    parser.add_argument('--probe',
+                        choices=['tcp', 'udp'], default='tcp',
+                        help='probe using TCP connect or UDP echo (default: %(default)s)')
+    parser.add_argument('--probe-port',
+                        type=int, default=22,
+                        help='port to probe (default: %(default)s)')
+    parser.add_argument('--timeout',
+                        type=float, default=120.0,
+                        help='seconds to wait for hosts to wake (default: %(default)s)')
+    parser.add_argument('--resend-after',
+                        type=float, default=10.0,
+                        help='seconds before first magic packet resend, doubling after each (default: %(default)s)')
+    args = parser.parse_args(arguments)
+
+    targets = [Target(mac, args.broadcast, args.port, host or None)
+               for mac, _, host in (mac_arg.partition('=') for mac_arg in args.mac)]
+    if args.inventory:
+        targets.extend(read_inventory(args.inventory, args.broadcast, args.port))
+    if args.stdin:
+        targets.extend(read_macs(sys.stdin, args.broadcast, args.port))
+    if not targets:
+        parser.error('no MAC addresses given')
+
+    for target, result in send_magic_packets(targets, rate=args.rate, burst=args.burst):
+        print(f'{target.mac} {target.broadcast}:{target.port} {result}')
+
+    if args.confirm:
+        for target in targets:
+            if not target.host:
+                print(f'{target.mac} has no host address to probe, not confirming', file=sys.stderr)
+        results = asyncio.run(confirm_targets(targets, args.probe, args.probe_port,
+                                              args.timeout, args.resend_after))
+        for target, wake_time in results:
+            if wake_time is None:
+                print(f'{target.mac} {target.host} DOWN')
+            else:
+                print(f'{target.mac} {target.host} UP {wake_time:.1f}s')
+
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
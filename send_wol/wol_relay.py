@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Long-running WOL relay. Accepts wake requests over local UDP and HTTP and
+sends the magic packet from one persistent broadcast socket, so that remote
+triggers (chat commands, scripts, etc.) don't have to start a new process.
+
+Hosts are looked up by host name or MAC address in an in-memory index built
+from a send_wol inventory file. Repeat requests for the same host within the
+dedup window are dropped.
+
+UDP: send a datagram containing the host name or MAC address.
+HTTP: GET or POST /wake/<host name or MAC address>
+
+@author: ammgws
+"""
+import asyncio
+import logging
+import sys
+from argparse import ArgumentParser
+from time import monotonic
+from urllib.parse import unquote
+
+from send_wol import (DEFAULT_BROADCAST, DEFAULT_PORT, Target, build_magic_packet, create_broadcast_socket,
+                      read_inventory, send_magic_packet)
+
+
+def normalise_key(key):
+    """ Normalise host name/MAC address so that lookups are case and separator insensitive."""
+    key = key.strip().lower()
+    if len(key) == 17 and key[2::3] in (':' * 5, '-' * 5):
+        key = key.replace('-', ':')
+    return key
+
+
+class WolRelay:
+    def __init__(self, targets, dedup_window=5.0, broadcast_address=DEFAULT_BROADCAST, port=DEFAULT_PORT):
+        self.broadcast_address = broadcast_address
+        self.port = port
+        self.dedup_window = dedup_window
+        # Index each host by both its host name and its MAC address.
+        self.index = {}
+        for target in targets:
+            self.index[normalise_key(target.mac)] = target
+            if target.host:
+                self.index[normalise_key(target.host)] = target
+        # MAC address -> time the last magic packet was sent to it
+        self.last_sent = {}
+        self.sock = create_broadcast_socket()
+
+    def resolve(self, key):
+        """ Look up Target for host name or MAC address. Unknown MACs use the default broadcast address/port.
+        Returns None if key is neither a known host nor a valid MAC address.
+        """
+        key = normalise_key(key)
+        target = self.index.get(key)
+        if target is None and len(key) == 17 and key[2::3] == ':' * 5:
+            try:
+                build_magic_packet(key)
+            except ValueError:
+                return None
+            target = Target(key, self.broadcast_address, self.port)
+        return target
+
+    def wake(self, key):
+        """ Send magic packet for host name or MAC address. Returns 'ACK', 'NAK', 'DUP', 'UNKNOWN' or 'ERROR'."""
+        target = self.resolve(key)
+        if target is None:
+            logging.info('Unknown host requested: %s', key)
+            return 'UNKNOWN'
+        mac = normalise_key(target.mac)
+        now = monotonic()
+        if now - self.last_sent.get(mac, -self.dedup_window) < self.dedup_window:
+            logging.debug('Dropping duplicate request for %s', key)
+            return 'DUP'
+        try:
+            result = send_magic_packet(target.mac, target.broadcast, target.port, sock=self.sock)
+        except (ValueError, OSError) as e:
+            # eg. bad MAC in the inventory file, or network unreachable
+            logging.error('Failed to send magic packet to %s (%s): %s', key, target.mac, e)
+            return 'ERROR'
+        # Only count successful sends for dedup, so a failed request can be retried straight away.
+        if result == 'ACK':
+            self.last_sent[mac] = now
+        logging.info('Sent magic packet to %s (%s): %s', key, target.mac, result)
+        return result
+
+    def close(self):
+        self.sock.close()
+
+
+class UdpRequestProtocol(asyncio.DatagramProtocol):
+    def __init__(self, relay):
+        self.relay = relay
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        result = self.relay.wake(data.decode('utf-8', errors='replace'))
+        self.transport.sendto(result.encode(), addr)
+
+
+def http_handler(relay):
+    async def handle(reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            # Discard headers, we don't need them.
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if len(request_line) >= 2 and request_line[0] in ('GET', 'POST') \
+                    and request_line[1].startswith('/wake/'):
+                result = relay.wake(unquote(request_line[1][len('/wake/'):]))
+                status = {'UNKNOWN': '404 Not Found',
+                          'ERROR': '500 Internal Server Error'}.get(result, '200 OK')
+            else:
+                result = 'Usage: /wake/<host>'
+                status = '400 Bad Request'
+            body = (result + '\n').encode()
+            writer.write(f'HTTP/1.0 {status}\r\nContent-Type: text/plain\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(relay, listen_address, udp_port, http_port):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: UdpRequestProtocol(relay),
+                                                       local_addr=(listen_address, udp_port))
+    server = await asyncio.start_server(http_handler(relay), listen_address, http_port)
+    logging.info('Listening on %s (UDP %s, HTTP %s)', listen_address, udp_port, http_port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        transport.close()
+
+
+def main(arguments):
+    parser = ArgumentParser(description='Relay wake requests to WOL magic packets.')
+    parser.add_argument('-i', '--inventory',
+                        help='CSV or JSON file of hosts (see send_wol.py)')
+    parser.add_argument('-l', '--listen',
+                        default='127.0.0.1',
+                        help='address to listen on (default: %(default)s)')
+    parser.add_argument('-u', '--udp-port',
+                        type=int, default=9009,
+                        help='UDP port to listen on (default: %(default)s)')
+    parser.add_argument('-t', '--http-port',
+                        type=int, default=9080,
+                        help='HTTP port to listen on (default: %(default)s)')
+    parser.add_argument('-w', '--dedup-window',
+                        type=float, default=5.0,
+                        help='seconds to ignore repeat requests for the same host (default: %(default)s)')
+    parser.add_argument('-b', '--broadcast',
+                        default=DEFAULT_BROADCAST,
+                        help='default broadcast address (default: %(default)s)')
+    parser.add_argument('-p', '--port',
+                        type=int, default=DEFAULT_PORT,
+                        help='default UDP port for magic packets (default: %(default)s)')
+    args = parser.parse_args(arguments)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s.%(msecs).03d %(levelname)-8s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    targets = read_inventory(args.inventory, args.broadcast, args.port) if args.inventory else []
+    relay = WolRelay(targets, args.dedup_window, args.broadcast, args.port)
+    try:
+        asyncio.run(serve(relay, args.listen, args.udp_port, args.http_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        relay.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])